@@ -1,11 +1,33 @@
 """
 Módulo de agentes especializados para o sistema de atendimento Caixa.
+
+Os agentes são importados sob demanda (PEP 562), de modo que importar o pacote
+não carrega os clientes de LLM/HTTP dos agentes que não forem usados.
 """
 
-from .base_agent import BaseAgent
-from .emprestimo_agent import EmprestimoAgent
-from .analise_risco_agent import AnaliseRiscoAgent
-from .web_search_agent import WebSearchAgent
-from .file_search_agent import FileSearchAgent
+import importlib
+
+_LAZY = {
+    'BaseAgent': '.base_agent',
+    'Usuario': '.base_agent',
+    'EmprestimoAgent': '.emprestimo_agent',
+    'AnaliseRiscoAgent': '.analise_risco_agent',
+    'WebSearchAgent': '.web_search_agent',
+    'FileSearchAgent': '.file_search_agent',
+}
+
+__all__ = ['BaseAgent', 'Usuario', 'EmprestimoAgent', 'AnaliseRiscoAgent', 'WebSearchAgent', 'FileSearchAgent']
+
+
+def __getattr__(name):
+    modulo = _LAZY.get(name)
+    if modulo is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    valor = getattr(importlib.import_module(modulo, __name__), name)
+    # Guarda no namespace do pacote para que os próximos acessos não passem por aqui
+    globals()[name] = valor
+    return valor
+
 
-__all__ = ['BaseAgent', 'EmprestimoAgent', 'AnaliseRiscoAgent', 'WebSearchAgent', 'FileSearchAgent']
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
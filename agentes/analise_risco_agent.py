@@ -1,21 +1,123 @@
-from typing import Dict, List, Any
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Sequence
+import copy
 import json
+import re
+import threading
+import time
 from .base_agent import BaseAgent
 
 
+# Tabela para remover acentos em uma única passada (str.translate é implementado em C)
+_ACCENT_TABLE = str.maketrans("áàâãéêíóôõúç", "aaaaeeiooouc")
+
+# Palavras-chave analisadas no histórico do chat (já sem acentos)
+_KW_EMPRESTIMO = frozenset({"emprestimo", "dinheiro", "valor", "financiamento"})
+_KW_URGENCIA = frozenset({"urgente", "rapido", "preciso agora", "emergencia"})
+
+
+def _normalizar_texto(texto: str) -> str:
+    """Converte para minúsculas e remove acentos para comparação de palavras-chave"""
+    return texto.lower().translate(_ACCENT_TABLE)
+
+
+def _compilar_palavras_chave(palavras: frozenset) -> "re.Pattern":
+    """Compila um conjunto de palavras-chave em uma única alternância (uma passada por mensagem)"""
+    # Termos mais longos primeiro para que a alternância não pare em um prefixo
+    return re.compile("|".join(map(re.escape, sorted(palavras, key=len, reverse=True))))
+
+
+_RE_EMPRESTIMO = _compilar_palavras_chave(_KW_EMPRESTIMO)
+_RE_URGENCIA = _compilar_palavras_chave(_KW_URGENCIA)
+
+
+@dataclass(slots=True)
+class PerfilRisco:
+    """Perfil de risco intermediário usado durante a análise"""
+    nivel_risco: str
+    score_risco: int
+    fatores_risco: Sequence[str] = field(default_factory=list)
+    fatores_positivos: Sequence[str] = field(default_factory=list)
+    score_risco_adicional: int = 0
+
+
 class AnaliseRiscoAgent(BaseAgent):
     """Agente especializado em análise de risco de cliente"""
     
+    __slots__ = ("_tool_def", "_cache", "_cache_lock")
+    
     # Constantes para níveis de risco
     RISCO_BAIXO = "BAIXO"
     RISCO_MEDIO = "MÉDIO"
     RISCO_ALTO = "ALTO"
     
+    # Níveis ordenados pela quantidade de limiares de score atingidos
+    _NIVEIS_RISCO = (RISCO_BAIXO, RISCO_MEDIO, RISCO_ALTO)
+    
+    # Fatores da análise cadastral
+    _FATOR_NOME_SUJO = "Cliente com restrições creditícias (nome sujo)"
+    _FATOR_CPF_LIMPO = "Cliente sem restrições no CPF"
+    
+    # Recomendações fixas por situação do cliente
+    _REC_NOME_SUJO = (
+        "Considere quitar suas pendências para melhorar seu score",
+        "Empréstimos limitados a R$ 500,00 devido às restrições",
+        "Explore produtos de recuperação de crédito da Caixa"
+    )
+    _REC_RISCO_ALTO = (
+        "Recomendamos cautela com novos compromissos financeiros",
+        "Busque orientação financeira antes de contratar empréstimos",
+        "Considere renegociar dívidas existentes"
+    )
+    _REC_RISCO_MEDIO = (
+        "Mantenha suas contas em dia para melhorar seu perfil",
+        "Considere empréstimos com parcelas menores",
+        "Avalie sua capacidade de pagamento antes de se comprometer"
+    )
+    _REC_RISCO_BAIXO = (
+        "Você tem um bom perfil creditício",
+        "Pode ser elegível para melhores condições de empréstimo",
+        "Continue mantendo suas contas em dia"
+    )
+    _REC_POR_NIVEL = {
+        RISCO_ALTO: _REC_RISCO_ALTO,
+        RISCO_MEDIO: _REC_RISCO_MEDIO,
+        RISCO_BAIXO: _REC_RISCO_BAIXO
+    }
+    
+    # Emoji exibido para cada nível de risco
+    _EMOJI_RISCO = {RISCO_BAIXO: "🟢", RISCO_MEDIO: "🟡", RISCO_ALTO: "🔴"}
+    
+    # Cache das análises em memória (evita recomputar o mesmo perfil durante a conversa)
+    CACHE_TTL_SEGUNDOS = 60
+    CACHE_MAX_ENTRADAS = 10_000
+    
     def __init__(self):
         super().__init__(
             nome="Análise de Risco Agent",
             descricao="Analisa o perfil de risco do cliente baseado em histórico de mensagens, empréstimos e informações cadastrais"
         )
+        
+        # Definição da tool montada uma única vez, reaproveitada a cada chamada
+        self._tool_def = {
+            "type": "function",
+            "function": {
+                "name": "analise_risco_agent",
+                "description": self.descricao,
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "cpf": {"type": "string", "description": "CPF do cliente para análise"},
+                        "incluir_historico": {"type": "boolean", "description": "Se deve incluir análise do histórico de chat", "default": True}
+                    },
+                    "required": ["cpf"],
+                    "additionalProperties": False
+                }
+            }
+        }
+        
+        self._cache: Dict[tuple, tuple] = {}
+        self._cache_lock = threading.Lock()
     
     def processar(self, cpf: str, usuarios_db: Dict, historico_chat: List[Dict] = None) -> Dict[str, Any]:
         """
@@ -29,7 +131,7 @@ class AnaliseRiscoAgent(BaseAgent):
         Returns:
             Dict com análise de risco do cliente
         """
-        usuario = usuarios_db.get(cpf)
+        usuario = self.obter_usuario(cpf, usuarios_db)
         if not usuario:
             return {
                 "erro": True,
@@ -37,21 +139,25 @@ class AnaliseRiscoAgent(BaseAgent):
                 "analise": None
             }
         
-        nome = usuario["nome"]
-        nome_sujo = usuario.get("nome_sujo", False)
+        nome, nome_sujo = self.dados_usuario(usuario)
+        
+        # Reaproveitar análise recente para o mesmo cliente e histórico
+        chave_cache = (cpf, nome, nome_sujo, self._assinatura_historico(historico_chat))
+        resultado_cache = self._obter_cache(chave_cache)
+        if resultado_cache is not None:
+            return resultado_cache
         
         # Análise básica do perfil
         perfil_risco = self._analisar_perfil_basico(nome_sujo)
         
         # Análise do histórico de chat se disponível
         if historico_chat:
-            historico_analise = self._analisar_historico_chat(historico_chat)
-            perfil_risco.update(historico_analise)
+            self._analisar_historico_chat(historico_chat, perfil_risco)
         
         # Gerar recomendações
         recomendacoes = self._gerar_recomendacoes(perfil_risco, nome_sujo)
         
-        return {
+        resultado = {
             "erro": False,
             "cliente": {
                 "nome": nome,
@@ -59,165 +165,175 @@ class AnaliseRiscoAgent(BaseAgent):
                 "nome_sujo": nome_sujo
             },
             "analise": {
-                "nivel_risco": perfil_risco["nivel_risco"],
-                "score_risco": perfil_risco["score_risco"],
-                "fatores_risco": perfil_risco["fatores_risco"],
-                "fatores_positivos": perfil_risco["fatores_positivos"],
+                "nivel_risco": perfil_risco.nivel_risco,
+                "score_risco": perfil_risco.score_risco,
+                "fatores_risco": perfil_risco.fatores_risco,
+                "fatores_positivos": perfil_risco.fatores_positivos,
                 "recomendacoes": recomendacoes
             },
             "mensagem": self._formatar_mensagem_analise(nome, perfil_risco, recomendacoes)
         }
+        
+        self._salvar_cache(chave_cache, resultado)
+        return resultado
     
-    def _analisar_perfil_basico(self, nome_sujo: bool) -> Dict[str, Any]:
-        """Análise básica baseada nas informações cadastrais"""
-        fatores_risco = []
-        fatores_positivos = []
-        score_risco = 0
+    def pontuar_em_lote(self, cpfs: List[str], usuarios_db: Dict) -> Dict[str, Dict[str, Any]]:
+        """
+        Calcula nível e score de risco cadastral para vários clientes de uma vez
         
-        if nome_sujo:
-            fatores_risco.append("Cliente com restrições creditícias (nome sujo)")
-            score_risco += 40
-        else:
-            fatores_positivos.append("Cliente sem restrições no CPF")
-            score_risco -= 10
-        
-        # Determinar nível de risco
-        if score_risco >= 50:
-            nivel_risco = self.RISCO_ALTO
-        elif score_risco >= 20:
-            nivel_risco = self.RISCO_MEDIO
-        else:
-            nivel_risco = self.RISCO_BAIXO
-        
-        return {
-            "nivel_risco": nivel_risco,
-            "score_risco": max(0, min(100, score_risco)),
-            "fatores_risco": fatores_risco,
-            "fatores_positivos": fatores_positivos
-        }
+        A análise cadastral depende apenas de nome_sujo, então cada perfil possível
+        é calculado uma única vez e reaproveitado para todos os clientes do lote.
+        
+        Args:
+            cpfs: CPFs a serem pontuados
+            usuarios_db: Base de dados dos usuários
+            
+        Returns:
+            Dict cpf -> {"nivel_risco", "score_risco"} (CPFs inexistentes são ignorados)
+        """
+        perfis = {}
+        resultado = {}
+        for cpf in cpfs:
+            usuario = self.obter_usuario(cpf, usuarios_db)
+            if not usuario:
+                continue
+            nome_sujo = bool(self.dados_usuario(usuario)[1])
+            perfil = perfis.get(nome_sujo)
+            if perfil is None:
+                perfil = perfis[nome_sujo] = self._analisar_perfil_basico(nome_sujo)
+            resultado[cpf] = {"nivel_risco": perfil.nivel_risco, "score_risco": perfil.score_risco}
+        return resultado
     
-    def _analisar_historico_chat(self, historico: List[Dict]) -> Dict[str, Any]:
-        """Análisa o histórico de mensagens para identificar padrões"""
-        updates = {
-            "fatores_risco": [],
-            "fatores_positivos": [],
-            "score_risco_adicional": 0
-        }
+    @staticmethod
+    def _assinatura_historico(historico_chat: List[Dict]) -> tuple:
+        """Gera uma assinatura compacta do histórico para compor a chave do cache"""
+        if not historico_chat:
+            return (0, 0)
+        return (
+            len(historico_chat),
+            hash(tuple((msg.get("role"), msg.get("content")) for msg in historico_chat))
+        )
+    
+    def _obter_cache(self, chave: tuple) -> Optional[Dict[str, Any]]:
+        """Retorna uma cópia da análise em cache se ainda estiver dentro do TTL"""
+        with self._cache_lock:
+            entrada = self._cache.get(chave)
+            if entrada is None:
+                return None
+            expira_em, resultado = entrada
+            if time.monotonic() >= expira_em:
+                del self._cache[chave]
+                return None
+        # Cópia para que o chamador não altere a entrada armazenada
+        return copy.deepcopy(resultado)
+    
+    def _salvar_cache(self, chave: tuple, resultado: Dict[str, Any]) -> None:
+        """Armazena a análise no cache, descartando a entrada mais antiga se estiver cheio"""
+        with self._cache_lock:
+            if chave not in self._cache and len(self._cache) >= self.CACHE_MAX_ENTRADAS:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[chave] = (time.monotonic() + self.CACHE_TTL_SEGUNDOS, copy.deepcopy(resultado))
+    
+    def _analisar_perfil_basico(self, nome_sujo: bool) -> PerfilRisco:
+        """Análise básica baseada nas informações cadastrais"""
+        score_risco = 40 if nome_sujo else -10
+        
+        # Determinar nível de risco: índice 0 (< 20), 1 (>= 20) ou 2 (>= 50)
+        nivel_risco = self._NIVEIS_RISCO[(score_risco >= 50) + (score_risco >= 20)]
         
-        # Contar mensagens do usuário
-        mensagens_usuario = [msg for msg in historico if msg.get("role") == "user"]
-        total_mensagens = len(mensagens_usuario)
+        fatores_risco = [self._FATOR_NOME_SUJO] if nome_sujo else []
+        fatores_positivos = [] if nome_sujo else [self._FATOR_CPF_LIMPO]
         
-        # Analisar conteúdo das mensagens
+        return PerfilRisco(
+            nivel_risco=nivel_risco,
+            score_risco=max(0, min(100, score_risco)),
+            fatores_risco=fatores_risco,
+            fatores_positivos=fatores_positivos
+        )
+    
+    def _analisar_historico_chat(self, historico: List[Dict], perfil_risco: PerfilRisco) -> None:
+        """Análisa o histórico de mensagens para identificar padrões e atualiza o perfil"""
+        # Listas de fatores só são criadas quando algum padrão é detectado
+        fatores_risco = None
+        fatores_positivos = None
+        score_risco_adicional = 0
+        
+        # Contar e analisar as mensagens do usuário em uma única passada
+        total_mensagens = 0
         emprestimos_solicitados = 0
         mencoes_urgencia = 0
         
-        for msg in mensagens_usuario:
-            content = msg.get("content", "").lower()
+        # Métodos ligados a variáveis locais para evitar lookups repetidos no laço
+        buscar_emprestimo = _RE_EMPRESTIMO.search
+        buscar_urgencia = _RE_URGENCIA.search
+        
+        for msg in historico:
+            get = msg.get
+            if get("role") != "user":
+                continue
+            total_mensagens += 1
+            content = _normalizar_texto(get("content") or "")
             
             # Detectar solicitações de empréstimo
-            if any(palavra in content for palavra in ["empréstimo", "emprestimo", "dinheiro", "valor", "financiamento"]):
+            if buscar_emprestimo(content):
                 emprestimos_solicitados += 1
             
             # Detectar urgência
-            if any(palavra in content for palavra in ["urgente", "rapido", "rápido", "preciso agora", "emergência"]):
+            if buscar_urgencia(content):
                 mencoes_urgencia += 1
         
         # Avalizar padrões
         if emprestimos_solicitados > 2:
-            updates["fatores_risco"].append("Múltiplas solicitações de empréstimo na conversa")
-            updates["score_risco_adicional"] += 15
+            fatores_risco = ["Múltiplas solicitações de empréstimo na conversa"]
+            score_risco_adicional += 15
         
         if mencoes_urgencia > 1:
-            updates["fatores_risco"].append("Demonstra urgência excessiva nas solicitações")
-            updates["score_risco_adicional"] += 10
+            if fatores_risco is None:
+                fatores_risco = []
+            fatores_risco.append("Demonstra urgência excessiva nas solicitações")
+            score_risco_adicional += 10
         
         if total_mensagens > 0 and emprestimos_solicitados == 0:
-            updates["fatores_positivos"].append("Cliente demonstra interesse em outros serviços além de empréstimos")
-            updates["score_risco_adicional"] -= 5
+            fatores_positivos = ["Cliente demonstra interesse em outros serviços além de empréstimos"]
+            score_risco_adicional -= 5
         
-        return updates
+        perfil_risco.fatores_risco = fatores_risco or ()
+        perfil_risco.fatores_positivos = fatores_positivos or ()
+        perfil_risco.score_risco_adicional = score_risco_adicional
     
-    def _gerar_recomendacoes(self, perfil_risco: Dict, nome_sujo: bool) -> List[str]:
+    def _gerar_recomendacoes(self, perfil_risco: PerfilRisco, nome_sujo: bool) -> List[str]:
         """Gera recomendações baseadas no perfil de risco"""
-        recomendacoes = []
-        
-        nivel_risco = perfil_risco["nivel_risco"]
-        
+        recomendacoes_nivel = self._REC_POR_NIVEL.get(perfil_risco.nivel_risco, self._REC_RISCO_BAIXO)
         if nome_sujo:
-            recomendacoes.extend([
-                "Considere quitar suas pendências para melhorar seu score",
-                "Empréstimos limitados a R$ 500,00 devido às restrições",
-                "Explore produtos de recuperação de crédito da Caixa"
-            ])
-        
-        if nivel_risco == self.RISCO_ALTO:
-            recomendacoes.extend([
-                "Recomendamos cautela com novos compromissos financeiros",
-                "Busque orientação financeira antes de contratar empréstimos",
-                "Considere renegociar dívidas existentes"
-            ])
-        elif nivel_risco == self.RISCO_MEDIO:
-            recomendacoes.extend([
-                "Mantenha suas contas em dia para melhorar seu perfil",
-                "Considere empréstimos com parcelas menores",
-                "Avalie sua capacidade de pagamento antes de se comprometer"
-            ])
-        else:  # RISCO_BAIXO
-            recomendacoes.extend([
-                "Você tem um bom perfil creditício",
-                "Pode ser elegível para melhores condições de empréstimo",
-                "Continue mantendo suas contas em dia"
-            ])
-        
-        return recomendacoes
-    
-    def _formatar_mensagem_analise(self, nome: str, perfil_risco: Dict, recomendacoes: List[str]) -> str:
+            return list(self._REC_NOME_SUJO + recomendacoes_nivel)
+        return list(recomendacoes_nivel)
+    
+    def _formatar_mensagem_analise(self, nome: str, perfil_risco: PerfilRisco, recomendacoes: List[str]) -> str:
         """Formata a mensagem de análise para o usuário"""
-        nivel_risco = perfil_risco["nivel_risco"]
-        score = perfil_risco["score_risco"]
-        
-        emoji_risco = {self.RISCO_BAIXO: "🟢", self.RISCO_MEDIO: "🟡", self.RISCO_ALTO: "🔴"}
+        nivel_risco = perfil_risco.nivel_risco
+        score = perfil_risco.score_risco
         
-        mensagem = f"""📊 **Análise de Risco - {nome}**
+        partes = [f"""📊 **Análise de Risco - {nome}**
 
-{emoji_risco[nivel_risco]} **Nível de Risco:** {nivel_risco} (Score: {score}/100)
+{self._EMOJI_RISCO[nivel_risco]} **Nível de Risco:** {nivel_risco} (Score: {score}/100)
 
-"""
-        
-        if perfil_risco["fatores_positivos"]:
-            mensagem += "✅ **Pontos Positivos:**\n"
-            for fator in perfil_risco["fatores_positivos"]:
-                mensagem += f"• {fator}\n"
-            mensagem += "\n"
-        
-        if perfil_risco["fatores_risco"]:
-            mensagem += "⚠️ **Fatores de Atenção:**\n"
-            for fator in perfil_risco["fatores_risco"]:
-                mensagem += f"• {fator}\n"
-            mensagem += "\n"
-        
-        mensagem += "💡 **Recomendações:**\n"
-        for rec in recomendacoes:
-            mensagem += f"• {rec}\n"
-        
-        return mensagem
+"""]
+
+        if perfil_risco.fatores_positivos:
+            partes.append("✅ **Pontos Positivos:**\n")
+            partes.extend(f"• {fator}\n" for fator in perfil_risco.fatores_positivos)
+            partes.append("\n")
+
+        if perfil_risco.fatores_risco:
+            partes.append("⚠️ **Fatores de Atenção:**\n")
+            partes.extend(f"• {fator}\n" for fator in perfil_risco.fatores_risco)
+            partes.append("\n")
+
+        partes.append("💡 **Recomendações:**\n")
+        partes.extend(f"• {rec}\n" for rec in recomendacoes)
+
+        return "".join(partes)
     
     def get_tool_definition(self) -> Dict[str, Any]:
         """Retorna a definição da tool para o function calling"""
-        return {
-            "type": "function",
-            "function": {
-                "name": "analise_risco_agent",
-                "description": self.descricao,
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "cpf": {"type": "string", "description": "CPF do cliente para análise"},
-                        "incluir_historico": {"type": "boolean", "description": "Se deve incluir análise do histórico de chat", "default": True}
-                    },
-                    "required": ["cpf"],
-                    "additionalProperties": False
-                }
-            }
-        }
+        return self._tool_def
@@ -1,10 +1,22 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple, Union
+
+
+@dataclass(slots=True)
+class Usuario:
+    """Registro de usuário da base (alternativa tipada ao dict carregado do JSON)"""
+    nome: str
+    cpf: str
+    nome_sujo: bool = False
 
 
 class BaseAgent(ABC):
     """Clase base abstrata para todos os agentes do sistema"""
     
+    __slots__ = ("nome", "descricao")
+    
     def __init__(self, nome: str, descricao: str):
         self.nome = nome
         self.descricao = descricao
@@ -14,6 +26,14 @@ class BaseAgent(ABC):
         """Método principal para processar a requisição do agente"""
         pass
     
+    async def processar_async(self, *args, **kwargs) -> Dict[str, Any]:
+        """Versão assíncrona de processar, executada em thread para não bloquear o event loop
+        
+        Permite que o orquestrador dispare vários agentes com asyncio.gather, de modo que
+        a latência total seja a do agente mais lento e não a soma de todos.
+        """
+        return await asyncio.to_thread(self.processar, *args, **kwargs)
+    
     @abstractmethod
     def get_tool_definition(self) -> Dict[str, Any]:
         """Retorna a definição da tool para o function calling"""
@@ -23,6 +43,17 @@ class BaseAgent(ABC):
         """Validação padrão de CPF na base de dados"""
         return cpf in usuarios_db
     
-    def obter_usuario(self, cpf: str, usuarios_db: Dict) -> Dict[str, Any]:
+    def obter_usuario(self, cpf: str, usuarios_db: Dict) -> Optional[Union[Dict[str, Any], Usuario]]:
         """Obtém dados do usuário pela base de dados"""
+        return self._buscar_usuario(cpf, usuarios_db)
+    
+    def _buscar_usuario(self, cpf: str, usuarios_db: Dict) -> Optional[Union[Dict[str, Any], Usuario]]:
+        """Leitura primitiva na base de usuários (ponto de troca para um armazenamento externo)"""
         return usuarios_db.get(cpf)
+    
+    @staticmethod
+    def dados_usuario(usuario: Union[Dict[str, Any], Usuario]) -> Tuple[str, bool]:
+        """Retorna (nome, nome_sujo) aceitando tanto o dict da base quanto um Usuario"""
+        if isinstance(usuario, Usuario):
+            return usuario.nome, usuario.nome_sujo
+        return usuario["nome"], usuario.get("nome_sujo", False)
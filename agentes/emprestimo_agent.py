@@ -5,11 +5,42 @@ from .base_agent import BaseAgent
 class EmprestimoAgent(BaseAgent):
     """Agente especializado em simulação e aprovação de empréstimos"""
     
+    __slots__ = ("_tool_def",)
+    
+    # Templates fixos das mensagens de resultado
+    _MSG_RECUSADO = (
+        "Empréstimo recusado para {nome} (CPF {cpf}): valor de R${valor:.2f} "
+        "acima do permitido para clientes com restrições (máximo R$500,00)."
+    )
+    _MSG_APROVADO = (
+        "Empréstimo aprovado para {nome} (CPF {cpf}) no valor de R${valor:.2f} "
+        "em {qtd_parcelas} parcelas de R${valor_parcela:.2f}."
+    )
+    
     def __init__(self):
         super().__init__(
             nome="Empréstimo Agent",
             descricao="Calcula aprovação/reprovação de empréstimo baseado no CPF, valor e parcelas do usuário"
         )
+        
+        # Definição da tool montada uma única vez, reaproveitada a cada chamada
+        self._tool_def = {
+            "type": "function",
+            "function": {
+                "name": "emprestimo_agent",
+                "description": self.descricao,
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "cpf": {"type": "string", "description": "CPF do solicitante"},
+                        "valor": {"type": "number", "exclusiveMinimum": 0, "description": "Valor solicitado para o empréstimo"},
+                        "qtd_parcelas": {"type": "integer", "minimum": 1, "description": "Número de parcelas para pagamento"}
+                    },
+                    "required": ["cpf", "valor", "qtd_parcelas"],
+                    "additionalProperties": False
+                }
+            }
+        }
     
     def processar(self, cpf: str, valor: float, qtd_parcelas: int, usuarios_db: Dict) -> Dict[str, Any]:
         """
@@ -24,7 +55,7 @@ class EmprestimoAgent(BaseAgent):
         Returns:
             Dict com resultado da análise do empréstimo
         """
-        usuario = usuarios_db.get(cpf)
+        usuario = self.obter_usuario(cpf, usuarios_db)
         if not usuario:
             return {
                 "aprovado": False,
@@ -32,52 +63,39 @@ class EmprestimoAgent(BaseAgent):
                 "valor_simulado": None
             }
         
-        nome = usuario["nome"]
-        nome_sujo = usuario.get("nome_sujo", False)
+        nome, nome_sujo = self.dados_usuario(usuario)
         
         # Regra de negócio: clientes com nome sujo só podem pedir até R$ 500
         if nome_sujo and valor > 500:
             return {
                 "aprovado": False,
-                "mensagem": (
-                    f"Empréstimo recusado para {nome} (CPF {cpf}): valor de R${valor:.2f} "
-                    f"acima do permitido para clientes com restrições (máximo R$500,00)."
-                ),
+                "mensagem": self._MSG_RECUSADO.format(nome=nome, cpf=cpf, valor=valor),
                 "valor_simulado": None
             }
         
-        # Calcular valor da parcela
-        valor_parcela = valor / qtd_parcelas
+        # Calcular valor da parcela em centavos inteiros, sobre os valores absolutos: meio
+        # centavo arredonda para longe de zero nos dois sentidos e o sinal volta no final
+        divisor = abs(qtd_parcelas)
+        valor_centavos = int(abs(valor) * 100 + 0.5)
+        parcela_centavos, resto = divmod(valor_centavos, divisor)
+        if resto * 2 >= divisor:
+            parcela_centavos += 1
+        if (valor < 0) != (qtd_parcelas < 0):
+            parcela_centavos = -parcela_centavos
+        valor_parcela = parcela_centavos / 100
         
         return {
             "aprovado": True,
-            "mensagem": (
-                f"Empréstimo aprovado para {nome} (CPF {cpf}) no valor de R${valor:.2f} "
-                f"em {qtd_parcelas} parcelas de R${valor_parcela:.2f}."
+            "mensagem": self._MSG_APROVADO.format(
+                nome=nome, cpf=cpf, valor=valor, qtd_parcelas=qtd_parcelas, valor_parcela=valor_parcela
             ),
             "valor_simulado": {
                 "valor_total": valor,
                 "qtd_parcelas": qtd_parcelas,
-                "valor_parcela": round(valor_parcela, 2)
+                "valor_parcela": valor_parcela
             }
         }
     
     def get_tool_definition(self) -> Dict[str, Any]:
         """Retorna a definição da tool para o function calling"""
-        return {
-            "type": "function",
-            "function": {
-                "name": "emprestimo_agent",
-                "description": self.descricao,
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "cpf": {"type": "string", "description": "CPF do solicitante"},
-                        "valor": {"type": "number", "description": "Valor solicitado para o empréstimo"},
-                        "qtd_parcelas": {"type": "integer", "description": "Número de parcelas para pagamento"}
-                    },
-                    "required": ["cpf", "valor", "qtd_parcelas"],
-                    "additionalProperties": False
-                }
-            }
-        }
+        return self._tool_def
@@ -1,14 +1,143 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Iterator
+from dataclasses import dataclass
+from functools import lru_cache
 from openai import OpenAI
 from pathlib import Path
 import json
+import logging
 import os
+import re
 from .base_agent import BaseAgent
 
+log = logging.getLogger("orchestrator")
+
+try:
+    # Parser em C/Rust, bem mais rápido que o json da biblioteca padrão (opcional)
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+
+@dataclass(slots=True, frozen=True)
+class ColunasTransacoes:
+    """Histórico em colunas (uma tupla por campo), compartilhado pelo cache entre as análises"""
+    dia: Tuple[str, ...]
+    tipo: Tuple[str, ...]
+    descricao: Tuple[str, ...]
+    descricao_lower: Tuple[str, ...]
+    valor: Tuple[float, ...]
+    saldo: Tuple[float, ...]
+
+
+def _totais_por_sinal(valores: List[float]) -> Tuple[float, int, float, float, int, float]:
+    """Soma, conta e acha o maior valor de receitas (valor > 0) e gastos (valor < 0) em uma única passada
+    
+    Retorna (total_receitas, qtd_receitas, maior_receita, total_gastos, qtd_gastos, maior_gasto),
+    com os gastos em módulo.
+    """
+    total_receitas = total_gastos = 0
+    qtd_receitas = qtd_gastos = 0
+    maior_receita = maior_gasto = 0
+    for v in valores:
+        if v > 0:
+            total_receitas += v
+            qtd_receitas += 1
+            if v > maior_receita:
+                maior_receita = v
+        elif v < 0:
+            total_gastos -= v
+            qtd_gastos += 1
+            if -v > maior_gasto:
+                maior_gasto = -v
+    return total_receitas, qtd_receitas, maior_receita, total_gastos, qtd_gastos, maior_gasto
+
+
+@lru_cache(maxsize=128)
+def _carregar_historico_cache(caminho: str, mtime_ns: int) -> Tuple[List[Dict], ColunasTransacoes, Dict[str, Any]]:
+    """Lê e converte o histórico de um CPF; o mtime na chave invalida a entrada quando o arquivo muda"""
+    with open(caminho, "rb") as f:
+        transacoes = _json_loads(f.read())
+    colunas = FileSearchAgent._montar_colunas(transacoes)
+    return transacoes, colunas, FileSearchAgent._calcular_agregados(colunas)
+
+
+def _iterar_transacoes(caminho: str, tamanho_bloco: int = 1 << 16) -> Iterator[Dict]:
+    """Lê o array JSON do histórico transação a transação, em blocos, sem materializar a lista inteira"""
+    decodificar = json.JSONDecoder().raw_decode
+    with open(caminho, "r", encoding="utf-8") as f:
+        buffer = f.read(tamanho_bloco).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError("O histórico de transações deve ser uma lista JSON")
+        buffer = buffer[1:]
+        fim_arquivo = False
+        
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                return
+            try:
+                transacao, fim = decodificar(buffer)
+            except json.JSONDecodeError:
+                # Transação cortada no fim do bloco: lê mais um pedaço e tenta de novo
+                if fim_arquivo:
+                    raise
+                bloco = f.read(tamanho_bloco)
+                fim_arquivo = not bloco
+                buffer += bloco
+                continue
+            yield transacao
+            buffer = buffer[fim:]
+
 
 class FileSearchAgent(BaseAgent):
     """Agente especializado em busca de informações em histórico de transações do cliente"""
     
+    __slots__ = ("client", "transaction_dir")
+    
+    # Acima deste tamanho, obter_resumo_transacoes agrega em fluxo em vez de carregar o arquivo todo
+    LIMITE_CARGA_COMPLETA_BYTES = 8 * 1024 * 1024
+    
+    # Rotas da pergunta, em ordem de prioridade: (palavras-chave, análise)
+    _ROTAS_PALAVRAS = (
+        # Análise de gastos com compras
+        (("compra", "compras", "gastei", "gasto"),
+         lambda self, transacoes, colunas, agregados, pergunta: self._analisar_gastos_compras(colunas, agregados, pergunta)),
+        # Análise de empréstimos
+        (("empréstimo", "emprestimo", "consignado", "parcela"),
+         lambda self, transacoes, colunas, agregados, pergunta: self._analisar_emprestimos(colunas, agregados)),
+        # Análise de FGTS
+        (("fgts",),
+         lambda self, transacoes, colunas, agregados, pergunta: self._analisar_fgts(colunas, agregados)),
+        # Análise de transferências/PIX
+        (("transferência", "transferencia", "pix", "ted"),
+         lambda self, transacoes, colunas, agregados, pergunta: self._analisar_transferencias(colunas, agregados)),
+        # Análise de padrões de gastos
+        (("padrão", "padrao", "habito", "comportamento"),
+         lambda self, transacoes, colunas, agregados, pergunta: self._analisar_padroes_gastos(agregados)),
+        # Resumo geral
+        (("resumo", "relatório", "relatorio", "historico", "histórico"),
+         lambda self, transacoes, colunas, agregados, pergunta: self._gerar_resumo_geral(colunas, agregados)),
+        # Análise de saldo
+        (("saldo", "evolução", "evolucao"),
+         lambda self, transacoes, colunas, agregados, pergunta: self._analisar_evolucao_saldo(agregados)),
+        # Busca específica por palavras-chave
+        (("faculdade", "educação", "educacao"),
+         lambda self, transacoes, colunas, agregados, pergunta: self._buscar_transacao_especifica(transacoes, colunas, "faculdade")),
+        (("devolução", "devolucao", "estorno"),
+         lambda self, transacoes, colunas, agregados, pergunta: self._buscar_transacao_especifica(transacoes, colunas, "devolução")),
+    )
+    
+    # Cada rota vira uma alternância pré-compilada (casamento por substring)
+    _ROTAS = tuple(
+        (re.compile("|".join(map(re.escape, palavras))), analisar) for palavras, analisar in _ROTAS_PALAVRAS
+    )
+    
+    # Índice palavra -> posição da rota, para resolver por token exato com uma consulta ao dict
+    _ROTA_POR_PALAVRA = {
+        palavra: posicao for posicao, (palavras, _) in enumerate(_ROTAS_PALAVRAS) for palavra in palavras
+    }
+    _RE_TOKEN = re.compile(r"\w+")
+    
     def __init__(self, client: Optional[OpenAI] = None):
         super().__init__(
             nome="File Search Agent",
@@ -28,26 +157,67 @@ class FileSearchAgent(BaseAgent):
         Returns:
             Dict com resultado da busca no histórico
         """
+        return self._processar_cpf(cpf, [pergunta])[0]
+    
+    def processar_batch(self, consultas: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Processa várias buscas de uma vez, carregando o histórico de cada CPF uma única vez
+        
+        Args:
+            consultas: Lista de tuplas (cpf, pergunta)
+            
+        Returns:
+            Lista com o resultado de cada consulta, na mesma ordem recebida
+        """
+        # Agrupar as consultas por CPF, guardando a posição original de cada uma
+        por_cpf: Dict[str, List[int]] = {}
+        for i, (cpf, _) in enumerate(consultas):
+            por_cpf.setdefault(cpf, []).append(i)
+        
+        resultados: List[Optional[Dict[str, Any]]] = [None] * len(consultas)
+        for cpf, indices in por_cpf.items():
+            respostas = self._processar_cpf(cpf, [consultas[i][1] for i in indices])
+            for i, resposta in zip(indices, respostas):
+                resultados[i] = resposta
+        
+        return resultados
+    
+    def _processar_cpf(self, cpf: str, perguntas: List[str]) -> List[Dict[str, Any]]:
+        """Responde às perguntas de um mesmo CPF a partir de uma única leitura do histórico"""
         try:
             # Verificar se existe histórico para este CPF
             arquivo_historico = self.transaction_dir / f"{cpf}.json"
             
             if not arquivo_historico.exists():
-                return {
-                    "erro": True,
-                    "mensagem": f"Não foi encontrado histórico de transações para o CPF {cpf}.",
-                    "cpf": cpf,
-                    "resultado": None
-                }
+                return [
+                    {
+                        "erro": True,
+                        "mensagem": f"Não foi encontrado histórico de transações para o CPF {cpf}.",
+                        "cpf": cpf,
+                        "resultado": None
+                    }
+                    for _ in perguntas
+                ]
+            
+            log.debug("[DEBUG] Analisando histórico de transações para CPF: %s", cpf)
             
-            print(f"[DEBUG] Analisando histórico de transações para CPF: {cpf}")
+            # Carregar o histórico (reaproveitado enquanto o arquivo não mudar)
+            transacoes, colunas, agregados = self._carregar_historico(arquivo_historico)
             
-            # Carregar e analisar o histórico diretamente
-            with open(arquivo_historico, "r", encoding="utf-8") as f:
-                transacoes = json.load(f)
+        except Exception as e:
+            return [self._erro_busca(cpf, e) for _ in perguntas]
+        
+        return [self._responder(cpf, pergunta, transacoes, colunas, agregados) for pergunta in perguntas]
+    
+    def _responder(self, cpf: str, pergunta: str, transacoes: List[Dict], colunas: ColunasTransacoes,
+                   agregados: Dict[str, Any]) -> Dict[str, Any]:
+        """Analisa uma pergunta sobre o histórico já carregado"""
+        try:
+            # Pergunta em minúsculas uma única vez; as análises recebem as duas formas
+            pergunta_lower = pergunta.lower()
             
             # Analisar as transações baseado na pergunta
-            resultado_analise = self._analisar_transacoes(transacoes, pergunta, cpf)
+            resultado_analise = self._analisar_transacoes(transacoes, colunas, agregados, pergunta, pergunta_lower, cpf)
             
             return {
                 "erro": False,
@@ -58,77 +228,194 @@ class FileSearchAgent(BaseAgent):
             }
             
         except Exception as e:
-            print(f"[ERRO] Erro na busca do histórico: {e}")
-            return {
-                "erro": True,
-                "cpf": cpf,
-                "mensagem": f"Não foi possível buscar no histórico de transações. Erro: {str(e)}",
-                "resultado": None
-            }
+            return self._erro_busca(cpf, e)
     
+    @staticmethod
+    def _erro_busca(cpf: str, e: Exception) -> Dict[str, Any]:
+        """Resultado padrão quando a busca no histórico falha"""
+        log.error("[ERRO] Erro na busca do histórico: %s", e)
+        return {
+            "erro": True,
+            "cpf": cpf,
+            "mensagem": f"Não foi possível buscar no histórico de transações. Erro: {str(e)}",
+            "resultado": None
+        }
     
-    def _analisar_transacoes(self, transacoes: List[Dict], pergunta: str, cpf: str) -> str:
-        """Analisa as transações baseado na pergunta do usuário"""
-        
-        pergunta_lower = pergunta.lower()
-        
-        # Análise de gastos com compras
-        if any(palavra in pergunta_lower for palavra in ["compra", "compras", "gastei", "gasto"]):
-            return self._analisar_gastos_compras(transacoes, pergunta_lower)
-        
-        # Análise de empréstimos
-        elif any(palavra in pergunta_lower for palavra in ["empréstimo", "emprestimo", "consignado", "parcela"]):
-            return self._analisar_emprestimos(transacoes)
-        
-        # Análise de FGTS
-        elif "fgts" in pergunta_lower:
-            return self._analisar_fgts(transacoes)
+    @staticmethod
+    def _carregar_historico(arquivo_historico: Path) -> Tuple[List[Dict], ColunasTransacoes, Dict[str, Any]]:
+        """Retorna (transações, colunas, agregados) do arquivo, usando o cache por (caminho, mtime)
         
-        # Análise de transferências/PIX
-        elif any(palavra in pergunta_lower for palavra in ["transferência", "transferencia", "pix", "ted"]):
-            return self._analisar_transferencias(transacoes)
-        
-        # Análise de padrões de gastos
-        elif any(palavra in pergunta_lower for palavra in ["padrão", "padrao", "habito", "comportamento"]):
-            return self._analisar_padroes_gastos(transacoes)
+        As estruturas retornadas são compartilhadas entre chamadas e não devem ser alteradas.
+        """
+        mtime_ns = os.stat(arquivo_historico).st_mtime_ns
+        return _carregar_historico_cache(str(arquivo_historico), mtime_ns)
+    
+    @staticmethod
+    def _montar_colunas(transacoes: List[Dict]) -> ColunasTransacoes:
+        """Reorganiza as transações em colunas (uma tupla por campo)
         
-        # Resumo geral
-        elif any(palavra in pergunta_lower for palavra in ["resumo", "relatório", "relatorio", "historico", "histórico"]):
-            return self._gerar_resumo_geral(transacoes)
+        As agregações percorrem sequências homogêneas e leem cada coluna por atributo,
+        em vez de buscar cada campo em um dict por transação.
+        """
+        return ColunasTransacoes(
+            # Data (AAAA-MM-DD) recortada uma única vez por arquivo, e não a cada relatório
+            dia=tuple(t["data"][:10] for t in transacoes),
+            tipo=tuple(t["tipo"] for t in transacoes),
+            descricao=tuple(t["descricao"] for t in transacoes),
+            # Descrições já em minúsculas para as buscas por termo
+            descricao_lower=tuple(t["descricao"].lower() for t in transacoes),
+            valor=tuple(t["valor"] for t in transacoes),
+            saldo=tuple(t["saldo"] for t in transacoes)
+        )
+    
+    @staticmethod
+    def _calcular_agregados(colunas: ColunasTransacoes) -> Dict[str, Any]:
+        """Pré-calcula totais, agrupamentos por tipo e extremos de saldo do histórico
         
-        # Análise de saldo
-        elif any(palavra in pergunta_lower for palavra in ["saldo", "evolução", "evolucao"]):
-            return self._analisar_evolucao_saldo(transacoes)
+        Calculado uma única vez por versão do arquivo (fica no mesmo cache das colunas),
+        de modo que resumo, saldo e padrões não varrem as transações a cada pergunta.
+        """
+        dias, tipos, valores, saldos = colunas.dia, colunas.tipo, colunas.valor, colunas.saldo
+        (total_receitas, qtd_receitas, maior_receita,
+         total_gastos, qtd_gastos, maior_gasto) = _totais_por_sinal(valores)
         
-        # Busca específica por palavras-chave
-        elif any(palavra in pergunta_lower for palavra in ["faculdade", "educação", "educacao"]):
-            return self._buscar_transacao_especifica(transacoes, "faculdade")
+        # Agrupar por tipo (gastos, receitas e contagem na mesma passada)
+        tipos_gastos = {}
+        tipos_receitas = {}
+        contagem_tipos = {}
+        for tipo, v in zip(tipos, valores):
+            contagem_tipos[tipo] = contagem_tipos.get(tipo, 0) + 1
+            if v < 0:
+                tipos_gastos[tipo] = tipos_gastos.get(tipo, 0) + abs(v)
+            elif v > 0:
+                tipos_receitas[tipo] = tipos_receitas.get(tipo, 0) + v
+        
+        agregados = {
+            "qtd_transacoes": len(valores),
+            "total_receitas": total_receitas,
+            "qtd_receitas": qtd_receitas,
+            "maior_receita": maior_receita,
+            "total_gastos": total_gastos,
+            "qtd_gastos": qtd_gastos,
+            "maior_gasto": maior_gasto,
+            # Agrupamentos já ordenados do maior para o menor total
+            "tipos_gastos": tuple(sorted(tipos_gastos.items(), key=lambda x: x[1], reverse=True)),
+            "tipos_receitas": tuple(sorted(tipos_receitas.items(), key=lambda x: x[1], reverse=True)),
+            "contagem_tipos": contagem_tipos
+        }
+        agregados.update(FileSearchAgent._indexar_categorias(colunas))
+        
+        if valores:
+            # Posição da primeira ocorrência de cada extremo (argmax/argmin), indexando a data
+            saldo_min = min(saldos)
+            saldo_max = max(saldos)
+            i_min = saldos.index(saldo_min)
+            i_max = saldos.index(saldo_max)
+            agregados.update({
+                "saldo_inicial": saldos[0] - valores[0],
+                "saldo_final": saldos[-1],
+                "saldo_min": saldo_min,
+                "saldo_max": saldo_max,
+                "data_saldo_max": dias[i_max],
+                "data_saldo_min": dias[i_min]
+            })
+        
+        return agregados
+    
+    @staticmethod
+    def _indexar_categorias(colunas: ColunasTransacoes) -> Dict[str, Any]:
+        """Pré-seleciona as posições e totais de cada categoria analisada (compras, empréstimos, FGTS, transferências)
         
-        elif any(palavra in pergunta_lower for palavra in ["devolução", "devolucao", "estorno"]):
-            return self._buscar_transacao_especifica(transacoes, "devolução")
+        Feito junto com os agregados, uma vez por versão do arquivo: as análises por categoria
+        passam a apenas formatar as transações já selecionadas.
+        """
+        compras, aprovados, recusados, parcelas = [], [], [], []
+        fgts, recebidas, enviadas = [], [], []
+        tem_emprestimo = tem_transferencia = False
+        
+        for i, (tipo, v, descricao) in enumerate(zip(colunas.tipo, colunas.valor, colunas.descricao_lower)):
+            if tipo == "compra":
+                if v < 0:
+                    compras.append(i)
+            elif tipo == "empréstimo":
+                tem_emprestimo = True
+                if v > 0:
+                    aprovados.append(i)
+                elif v == 0:
+                    recusados.append(i)
+            elif tipo == "FGTS":
+                fgts.append(i)
+            elif tipo == "transferência":
+                tem_transferencia = True
+                if v > 0:
+                    recebidas.append(i)
+                elif v < 0:
+                    enviadas.append(i)
+            if "empréstimo consignado" in descricao:
+                parcelas.append(i)
+        
+        valor = colunas.valor
+        return {
+            "idx_compras": tuple(compras),
+            "total_compras": sum(abs(valor[i]) for i in compras),
+            "tem_emprestimo": tem_emprestimo,
+            "idx_emprestimos_aprovados": tuple(aprovados),
+            "idx_emprestimos_recusados": tuple(recusados),
+            "idx_parcelas_consignado": tuple(parcelas),
+            "total_parcelas_consignado": sum(abs(valor[i]) for i in parcelas),
+            "idx_fgts": tuple(fgts),
+            "total_fgts": sum(valor[i] for i in fgts),
+            "tem_transferencia": tem_transferencia,
+            "idx_transferencias_recebidas": tuple(recebidas),
+            "total_transferencias_recebidas": sum(valor[i] for i in recebidas),
+            "idx_transferencias_enviadas": tuple(enviadas),
+            "total_transferencias_enviadas": sum(abs(valor[i]) for i in enviadas)
+        }
+    
+    def _analisar_transacoes(self, transacoes: List[Dict], colunas: ColunasTransacoes, agregados: Dict[str, Any],
+                             pergunta: str, pergunta_lower: str, cpf: str) -> str:
+        """Analisa as transações baseado na pergunta do usuário (pergunta_lower: a pergunta já em minúsculas)"""
+        
+        # Rota de maior prioridade entre as palavras da pergunta que são palavras-chave exatas
+        rotas = self._ROTAS
+        rota_por_palavra = self._ROTA_POR_PALAVRA
+        limite = len(rotas)
+        for token in self._RE_TOKEN.findall(pergunta_lower):
+            posicao = rota_por_palavra.get(token)
+            if posicao is not None and posicao < limite:
+                limite = posicao
+        
+        # Só as rotas mais prioritárias ainda podem casar por substring (ex.: "gastos" contém "gasto");
+        # a primeira cujo padrão aparece na pergunta decide a análise
+        for padrao, analisar in rotas[:limite]:
+            if padrao.search(pergunta_lower):
+                return analisar(self, transacoes, colunas, agregados, pergunta_lower)
+        
+        if limite < len(rotas):
+            return rotas[limite][1](self, transacoes, colunas, agregados, pergunta_lower)
         
         # Busca geral
-        else:
-            return self._buscar_informacao_geral(transacoes, pergunta)
+        return self._buscar_informacao_geral(transacoes, colunas, pergunta, pergunta_lower)
     
-    def _analisar_gastos_compras(self, transacoes: List[Dict], pergunta: str) -> str:
+    def _analisar_gastos_compras(self, colunas: ColunasTransacoes, agregados: Dict[str, Any], pergunta: str) -> str:
         """Analisa gastos com compras"""
-        compras = [t for t in transacoes if t["tipo"] == "compra" and t["valor"] < 0]
+        dia, descricao, valor = colunas.dia, colunas.descricao, colunas.valor
+        compras = agregados["idx_compras"]
         
         if not compras:
             return "Não foram encontradas transações de compra no seu histórico."
         
-        total_compras = sum(abs(t["valor"]) for t in compras)
+        total_compras = agregados["total_compras"]
         
         # Se pergunta menciona "último mês" ou período específico
         if "último mês" in pergunta or "ultimo mes" in pergunta:
             # Pegar as transações mais recentes
             compras_recentes = compras[-10:] if len(compras) > 10 else compras
-            total_recente = sum(abs(t["valor"]) for t in compras_recentes)
+            total_recente = sum(abs(valor[i]) for i in compras_recentes)
             
             detalhes = "\n".join([
-                f"• {t['data'][:10]}: {t['descricao']} - R$ {abs(t['valor']):.2f}"
-                for t in compras_recentes
+                f"• {dia[i]}: {descricao[i]} - R$ {abs(valor[i]):.2f}"
+                for i in compras_recentes
             ])
             
             return f"""**Gastos com Compras (Período Recente):**
@@ -144,8 +431,8 @@ class FileSearchAgent(BaseAgent):
         
         # Análise geral de compras
         detalhes_todas = "\n".join([
-            f"• {t['data'][:10]}: {t['descricao']} - R$ {abs(t['valor']):.2f}"
-            for t in compras
+            f"• {dia[i]}: {descricao[i]} - R$ {abs(valor[i]):.2f}"
+            for i in compras
         ])
         
         return f"""**Análise Completa dos Gastos com Compras:**
@@ -157,115 +444,105 @@ class FileSearchAgent(BaseAgent):
 **Detalhamento de todas as compras:**
 {detalhes_todas}"""
     
-    def _analisar_emprestimos(self, transacoes: List[Dict]) -> str:
+    def _analisar_emprestimos(self, colunas: ColunasTransacoes, agregados: Dict[str, Any]) -> str:
         """Analisa histórico de empréstimos"""
-        emprestimos = [t for t in transacoes if t["tipo"] == "empréstimo"]
-        
-        if not emprestimos:
+        if not agregados["tem_emprestimo"]:
             return "Não foram encontradas transações de empréstimo no seu histórico."
         
-        aprovados = [t for t in emprestimos if t["valor"] > 0]
-        recusados = [t for t in emprestimos if t["valor"] == 0]
-        parcelas = [t for t in transacoes if "empréstimo consignado" in t["descricao"].lower()]
+        dia, descricao, valor = colunas.dia, colunas.descricao, colunas.valor
+        parcelas = agregados["idx_parcelas_consignado"]
+        total_parcelas = agregados["total_parcelas_consignado"]
         
-        resultado = "**Análise do Histórico de Empréstimos:**\n\n"
+        partes = ["**Análise do Histórico de Empréstimos:**\n\n"]
+        adicionar = partes.append
         
-        if aprovados:
-            for emp in aprovados:
-                resultado += f"✅ **Empréstimo Aprovado:** {emp['data'][:10]}\n"
-                resultado += f"   • {emp['descricao']}\n"
-                resultado += f"   • Valor: R$ {emp['valor']:.2f}\n\n"
+        for i in agregados["idx_emprestimos_aprovados"]:
+            adicionar(
+                f"✅ **Empréstimo Aprovado:** {dia[i]}\n"
+                f"   • {descricao[i]}\n"
+                f"   • Valor: R$ {valor[i]:.2f}\n\n"
+            )
         
-        if recusados:
-            for emp in recusados:
-                resultado += f"❌ **Empréstimo Recusado:** {emp['data'][:10]}\n"
-                resultado += f"   • {emp['descricao']}\n\n"
+        for i in agregados["idx_emprestimos_recusados"]:
+            adicionar(
+                f"❌ **Empréstimo Recusado:** {dia[i]}\n"
+                f"   • {descricao[i]}\n\n"
+            )
         
         if parcelas:
-            total_parcelas = sum(abs(t["valor"]) for t in parcelas)
-            resultado += "💳 **Parcelas Pagas:**\n"
-            resultado += f"   • Total pago em parcelas: R$ {total_parcelas:.2f}\n"
-            resultado += f"   • Número de parcelas pagas: {len(parcelas)}\n"
-            resultado += f"   • Valor médio das parcelas: R$ {total_parcelas/len(parcelas):.2f}\n\n"
+            adicionar(
+                "💳 **Parcelas Pagas:**\n"
+                f"   • Total pago em parcelas: R$ {total_parcelas:.2f}\n"
+                f"   • Número de parcelas pagas: {len(parcelas)}\n"
+                f"   • Valor médio das parcelas: R$ {total_parcelas/len(parcelas):.2f}\n\n"
+            )
             
-            for parcela in parcelas:
-                resultado += f"   • {parcela['data'][:10]}: R$ {abs(parcela['valor']):.2f}\n"
+            for i in parcelas:
+                adicionar(f"   • {dia[i]}: R$ {abs(valor[i]):.2f}\n")
         
-        return resultado
+        return "".join(partes)
     
-    def _analisar_fgts(self, transacoes: List[Dict]) -> str:
+    def _analisar_fgts(self, colunas: ColunasTransacoes, agregados: Dict[str, Any]) -> str:
         """Analisa movimentações do FGTS"""
-        fgts_transacoes = [t for t in transacoes if t["tipo"] == "FGTS"]
+        fgts_transacoes = agregados["idx_fgts"]
         
         if not fgts_transacoes:
             return "Não foram encontradas movimentações de FGTS no seu histórico."
         
-        total_fgts = sum(t["valor"] for t in fgts_transacoes)
+        dia, descricao, valor = colunas.dia, colunas.descricao, colunas.valor
+        total_fgts = agregados["total_fgts"]
         
-        resultado = f"""**Análise das Movimentações FGTS:**
+        partes = [f"""**Análise das Movimentações FGTS:**
 
 **Total recebido:** R$ {total_fgts:.2f}
 **Número de movimentações:** {len(fgts_transacoes)}
 
 **Detalhamento:**
-"""
+"""]
         
-        for fgts in fgts_transacoes:
-            resultado += f"• {fgts['data'][:10]}: {fgts['descricao']} - R$ {fgts['valor']:.2f}\n"
+        partes.extend(
+            f"• {dia[i]}: {descricao[i]} - R$ {valor[i]:.2f}\n"
+            for i in fgts_transacoes
+        )
         
-        return resultado
+        return "".join(partes)
     
-    def _analisar_transferencias(self, transacoes: List[Dict]) -> str:
+    def _analisar_transferencias(self, colunas: ColunasTransacoes, agregados: Dict[str, Any]) -> str:
         """Analisa transferências e PIX"""
-        transferencias = [t for t in transacoes if t["tipo"] == "transferência"]
-        
-        if not transferencias:
+        if not agregados["tem_transferencia"]:
             return "Não foram encontradas transferências no seu histórico."
         
-        recebidas = [t for t in transferencias if t["valor"] > 0]
-        enviadas = [t for t in transferencias if t["valor"] < 0]
+        dia, descricao, valor = colunas.dia, colunas.descricao, colunas.valor
+        recebidas = agregados["idx_transferencias_recebidas"]
+        enviadas = agregados["idx_transferencias_enviadas"]
         
-        total_recebido = sum(t["valor"] for t in recebidas)
-        total_enviado = sum(abs(t["valor"]) for t in enviadas)
+        total_recebido = agregados["total_transferencias_recebidas"]
+        total_enviado = agregados["total_transferencias_enviadas"]
         
-        resultado = f"""**Análise de Transferências:**
+        partes = [f"""**Análise de Transferências:**
 
 **Transferências Recebidas:** {len(recebidas)} - Total: R$ {total_recebido:.2f}
 **Transferências Enviadas:** {len(enviadas)} - Total: R$ {total_enviado:.2f}
 
 **Transferências Recebidas:**
-"""
+"""]
         
-        for t in recebidas:
-            resultado += f"• {t['data'][:10]}: {t['descricao']} - R$ {t['valor']:.2f}\n"
+        partes.extend(f"• {dia[i]}: {descricao[i]} - R$ {valor[i]:.2f}\n" for i in recebidas)
         
         if enviadas:
-            resultado += "\n**Transferências Enviadas:**\n"
-            for t in enviadas:
-                resultado += f"• {t['data'][:10]}: {t['descricao']} - R$ {abs(t['valor']):.2f}\n"
+            partes.append("\n**Transferências Enviadas:**\n")
+            partes.extend(f"• {dia[i]}: {descricao[i]} - R$ {abs(valor[i]):.2f}\n" for i in enviadas)
         
-        return resultado
+        return "".join(partes)
     
-    def _analisar_padroes_gastos(self, transacoes: List[Dict]) -> str:
+    def _analisar_padroes_gastos(self, agregados: Dict[str, Any]) -> str:
         """Analisa padrões de gastos do cliente"""
-        gastos = [t for t in transacoes if t["valor"] < 0]
-        receitas = [t for t in transacoes if t["valor"] > 0]
-        
-        total_gastos = sum(abs(t["valor"]) for t in gastos)
-        total_receitas = sum(t["valor"] for t in receitas)
+        total_gastos = agregados["total_gastos"]
+        total_receitas = agregados["total_receitas"]
+        tipos_gastos = agregados["tipos_gastos"]
+        tipos_receitas = agregados["tipos_receitas"]
         
-        # Agrupar por tipo
-        tipos_gastos = {}
-        for t in gastos:
-            tipo = t["tipo"]
-            tipos_gastos[tipo] = tipos_gastos.get(tipo, 0) + abs(t["valor"])
-        
-        tipos_receitas = {}
-        for t in receitas:
-            tipo = t["tipo"]
-            tipos_receitas[tipo] = tipos_receitas.get(tipo, 0) + t["valor"]
-        
-        resultado = f"""**Análise de Padrões Financeiros:**
+        partes = [f"""**Análise de Padrões Financeiros:**
 
 **Resumo Geral:**
 • Total de gastos: R$ {total_gastos:.2f}
@@ -273,40 +550,39 @@ class FileSearchAgent(BaseAgent):
 • Saldo líquido: R$ {total_receitas - total_gastos:.2f}
 
 **Distribuição dos Gastos por Categoria:**
-"""
+"""]
+        adicionar = partes.append
         
-        for tipo, valor in sorted(tipos_gastos.items(), key=lambda x: x[1], reverse=True):
+        for tipo, valor in tipos_gastos:
             percentual = (valor / total_gastos) * 100
-            resultado += f"• {tipo.title()}: R$ {valor:.2f} ({percentual:.1f}%)\n"
+            adicionar(f"• {tipo.title()}: R$ {valor:.2f} ({percentual:.1f}%)\n")
         
-        resultado += "\n**Distribuição das Receitas por Tipo:**\n"
+        adicionar("\n**Distribuição das Receitas por Tipo:**\n")
         
-        for tipo, valor in sorted(tipos_receitas.items(), key=lambda x: x[1], reverse=True):
+        for tipo, valor in tipos_receitas:
             percentual = (valor / total_receitas) * 100
-            resultado += f"• {tipo.title()}: R$ {valor:.2f} ({percentual:.1f}%)\n"
+            adicionar(f"• {tipo.title()}: R$ {valor:.2f} ({percentual:.1f}%)\n")
         
-        return resultado
+        return "".join(partes)
     
-    def _gerar_resumo_geral(self, transacoes: List[Dict]) -> str:
+    def _gerar_resumo_geral(self, colunas: ColunasTransacoes, agregados: Dict[str, Any]) -> str:
         """Gera um resumo geral do histórico"""
-        if not transacoes:
+        valores, dias = colunas.valor, colunas.dia
+        if not valores:
             return "Nenhuma transação encontrada no histórico."
         
-        saldo_inicial = transacoes[0]["saldo"] - transacoes[0]["valor"]
-        saldo_final = transacoes[-1]["saldo"]
-        primeira_data = transacoes[0]["data"][:10]
-        ultima_data = transacoes[-1]["data"][:10]
+        saldo_inicial = agregados["saldo_inicial"]
+        saldo_final = agregados["saldo_final"]
+        primeira_data = dias[0]
+        ultima_data = dias[-1]
         
-        gastos = [t for t in transacoes if t["valor"] < 0]
-        receitas = [t for t in transacoes if t["valor"] > 0]
-        
-        total_gastos = sum(abs(t["valor"]) for t in gastos)
-        total_receitas = sum(t["valor"] for t in receitas)
+        total_receitas, qtd_receitas = agregados["total_receitas"], agregados["qtd_receitas"]
+        total_gastos, qtd_gastos = agregados["total_gastos"], agregados["qtd_gastos"]
         
         return f"""**Resumo Completo do Histórico Financeiro:**
 
 **Período:** {primeira_data} a {ultima_data}
-**Total de transações:** {len(transacoes)}
+**Total de transações:** {agregados["qtd_transacoes"]}
 
 **Evolução do Saldo:**
 • Saldo inicial: R$ {saldo_inicial:.2f}
@@ -314,31 +590,29 @@ class FileSearchAgent(BaseAgent):
 • Variação: R$ {saldo_final - saldo_inicial:.2f}
 
 **Movimentação Financeira:**
-• Total de receitas: R$ {total_receitas:.2f} ({len(receitas)} transações)
-• Total de gastos: R$ {total_gastos:.2f} ({len(gastos)} transações)
+• Total de receitas: R$ {total_receitas:.2f} ({qtd_receitas} transações)
+• Total de gastos: R$ {total_gastos:.2f} ({qtd_gastos} transações)
 • Saldo líquido do período: R$ {total_receitas - total_gastos:.2f}
 
 **Transação de Maior Valor:**
-• Receita: R$ {max([t["valor"] for t in receitas], default=0):.2f}
-• Gasto: R$ {max([abs(t["valor"]) for t in gastos], default=0):.2f}
+• Receita: R$ {agregados["maior_receita"]:.2f}
+• Gasto: R$ {agregados["maior_gasto"]:.2f}
 
 **Média por Transação:**
-• Receitas: R$ {total_receitas/len(receitas) if receitas else 0:.2f}
-• Gastos: R$ {total_gastos/len(gastos) if gastos else 0:.2f}"""
+• Receitas: R$ {total_receitas/qtd_receitas if qtd_receitas else 0:.2f}
+• Gastos: R$ {total_gastos/qtd_gastos if qtd_gastos else 0:.2f}"""
     
-    def _analisar_evolucao_saldo(self, transacoes: List[Dict]) -> str:
+    def _analisar_evolucao_saldo(self, agregados: Dict[str, Any]) -> str:
         """Analisa a evolução do saldo ao longo do tempo"""
-        if not transacoes:
+        if not agregados["qtd_transacoes"]:
             return "Nenhuma transação encontrada para análise de saldo."
         
-        saldo_min = min(t["saldo"] for t in transacoes)
-        saldo_max = max(t["saldo"] for t in transacoes)
-        saldo_inicial = transacoes[0]["saldo"] - transacoes[0]["valor"]
-        saldo_final = transacoes[-1]["saldo"]
-        
-        # Encontrar quando teve maior e menor saldo
-        data_saldo_max = next(t["data"][:10] for t in transacoes if t["saldo"] == saldo_max)
-        data_saldo_min = next(t["data"][:10] for t in transacoes if t["saldo"] == saldo_min)
+        saldo_min = agregados["saldo_min"]
+        saldo_max = agregados["saldo_max"]
+        saldo_inicial = agregados["saldo_inicial"]
+        saldo_final = agregados["saldo_final"]
+        data_saldo_max = agregados["data_saldo_max"]
+        data_saldo_min = agregados["data_saldo_min"]
         
         # Determinar tendência
         if saldo_final > saldo_inicial:
@@ -361,53 +635,56 @@ class FileSearchAgent(BaseAgent):
 
 **Tendência:** {tendencia}"""
     
-    def _buscar_transacao_especifica(self, transacoes: List[Dict], termo: str) -> str:
-        """Busca transações específicas por termo"""
-        transacoes_encontradas = []
-        
-        for t in transacoes:
-            if termo.lower() in t["descricao"].lower():
-                transacoes_encontradas.append(t)
+    def _buscar_transacao_especifica(self, transacoes: List[Dict], colunas: ColunasTransacoes, termo: str) -> str:
+        """Busca transações específicas por termo (já em minúsculas, comparado às descrições pré-convertidas)"""
+        transacoes_encontradas = [
+            t for t, descricao in zip(transacoes, colunas.descricao_lower) if termo in descricao
+        ]
         
         if not transacoes_encontradas:
             return f"Não foram encontradas transações relacionadas a '{termo}' no seu histórico."
         
         total_valor = sum(t["valor"] for t in transacoes_encontradas)
         
-        resultado = f"**Transações relacionadas a '{termo.title()}':**\n\n"
-        resultado += f"**Total de transações:** {len(transacoes_encontradas)}\n"
-        resultado += f"**Valor total:** R$ {total_valor:.2f}\n\n"
-        resultado += "**Detalhamento:**\n"
+        partes = [
+            f"**Transações relacionadas a '{termo.title()}':**\n\n"
+            f"**Total de transações:** {len(transacoes_encontradas)}\n"
+            f"**Valor total:** R$ {total_valor:.2f}\n\n"
+            "**Detalhamento:**\n"
+        ]
+        partes.extend(map(self._formatar_detalhe_transacao, transacoes_encontradas))
         
-        for t in transacoes_encontradas:
-            resultado += f"• **{t['data'][:10]}** - {t['tipo'].title()}\n"
-            resultado += f"  {t['descricao']}\n"
-            resultado += f"  Valor: R$ {t['valor']:.2f} | Saldo após: R$ {t['saldo']:.2f}\n\n"
-        
-        return resultado
+        return "".join(partes)
     
-    def _buscar_informacao_geral(self, transacoes: List[Dict], pergunta: str) -> str:
+    def _buscar_informacao_geral(self, transacoes: List[Dict], colunas: ColunasTransacoes, pergunta: str,
+                                 pergunta_lower: str) -> str:
         """Busca informações gerais baseadas na pergunta"""
-        # Buscar palavras-chave na pergunta
-        palavras_chave = pergunta.lower().split()
+        # Buscar palavras-chave na pergunta (uma única alternância por descrição)
+        palavras_chave = pergunta_lower.split()
         
         transacoes_relevantes = []
-        for t in transacoes:
-            descricao_lower = t["descricao"].lower()
-            if any(palavra in descricao_lower for palavra in palavras_chave):
-                transacoes_relevantes.append(t)
+        if palavras_chave:
+            buscar = re.compile("|".join(map(re.escape, palavras_chave))).search
+            transacoes_relevantes = [
+                t for t, descricao in zip(transacoes, colunas.descricao_lower) if buscar(descricao)
+            ]
         
         if not transacoes_relevantes:
             return f"Não foram encontradas transações relacionadas à sua consulta: '{pergunta}'"
         
-        resultado = f"**Transações encontradas para '{pergunta}':**\n\n"
-        
-        for t in transacoes_relevantes:
-            resultado += f"• **{t['data'][:10]}** - {t['tipo'].title()}\n"
-            resultado += f"  {t['descricao']}\n"
-            resultado += f"  Valor: R$ {t['valor']:.2f} | Saldo após: R$ {t['saldo']:.2f}\n\n"
+        partes = [f"**Transações encontradas para '{pergunta}':**\n\n"]
+        partes.extend(map(self._formatar_detalhe_transacao, transacoes_relevantes))
         
-        return resultado
+        return "".join(partes)
+    
+    @staticmethod
+    def _formatar_detalhe_transacao(t: Dict) -> str:
+        """Bloco de detalhe de uma transação usado nas buscas por termo"""
+        return (
+            f"• **{t['data'][:10]}** - {t['tipo'].title()}\n"
+            f"  {t['descricao']}\n"
+            f"  Valor: R$ {t['valor']:.2f} | Saldo após: R$ {t['saldo']:.2f}\n\n"
+        )
     
     def _formatar_resultado_busca(self, cpf: str, pergunta: str, resultado: str) -> str:
         """Formata o resultado da busca para apresentação ao usuário"""
@@ -452,13 +729,12 @@ class FileSearchAgent(BaseAgent):
         if not self.transaction_dir.exists():
             return []
         
-        cpfs = []
-        for arquivo in self.transaction_dir.glob("*.json"):
-            cpf = arquivo.stem
-            if cpf.isdigit() and len(cpf) == 11:  # Validação básica de CPF
-                cpfs.append(cpf)
-        
-        return cpfs
+        # os.scandir entrega os nomes direto do diretório, sem montar um Path por arquivo
+        with os.scandir(self.transaction_dir) as entradas:
+            return [
+                nome[:-5] for nome in (entrada.name for entrada in entradas)
+                if len(nome) == 16 and nome.endswith(".json") and nome[:-5].isdigit()  # Validação básica de CPF
+            ]
     
     def verificar_historico_disponivel(self, cpf: str) -> bool:
         """Verifica se existe histórico para o CPF especificado"""
@@ -473,35 +749,54 @@ class FileSearchAgent(BaseAgent):
             return None
         
         try:
-            with open(arquivo_historico, "r", encoding="utf-8") as f:
-                transacoes = json.load(f)
+            if os.stat(arquivo_historico).st_size > self.LIMITE_CARGA_COMPLETA_BYTES:
+                return self._resumir_em_fluxo(arquivo_historico)
+            
+            transacoes, _, agregados = self._carregar_historico(arquivo_historico)
             
             if not transacoes:
                 return None
             
-            total_transacoes = len(transacoes)
-            primeira_data = transacoes[0]["data"]
-            ultima_data = transacoes[-1]["data"]
-            saldo_atual = transacoes[-1]["saldo"]
-            
-            # Contar tipos de transação
-            tipos = {}
-            for t in transacoes:
-                tipo = t["tipo"]
-                tipos[tipo] = tipos.get(tipo, 0) + 1
-            
             return {
-                "total_transacoes": total_transacoes,
-                "primeira_transacao": primeira_data,
-                "ultima_transacao": ultima_data,
-                "saldo_atual": saldo_atual,
-                "tipos_transacao": tipos
+                "total_transacoes": agregados["qtd_transacoes"],
+                "primeira_transacao": transacoes[0]["data"],
+                "ultima_transacao": transacoes[-1]["data"],
+                "saldo_atual": agregados["saldo_final"],
+                # Cópia, pois a contagem pré-calculada é compartilhada pelo cache
+                "tipos_transacao": dict(agregados["contagem_tipos"])
             }
             
         except Exception as e:
-            print(f"[ERRO] Erro ao ler resumo: {e}")
+            log.error("[ERRO] Erro ao ler resumo: %s", e)
+            return None
+    
+    @staticmethod
+    def _resumir_em_fluxo(arquivo_historico: Path) -> Optional[Dict[str, Any]]:
+        """Mesmo resumo de obter_resumo_transacoes, acumulado transação a transação (históricos grandes)"""
+        total_transacoes = 0
+        primeira_data = ultima_data = saldo_atual = None
+        tipos = {}
+        
+        for t in _iterar_transacoes(str(arquivo_historico)):
+            if not total_transacoes:
+                primeira_data = t["data"]
+            total_transacoes += 1
+            ultima_data = t["data"]
+            saldo_atual = t["saldo"]
+            tipo = t["tipo"]
+            tipos[tipo] = tipos.get(tipo, 0) + 1
+        
+        if not total_transacoes:
             return None
+        
+        return {
+            "total_transacoes": total_transacoes,
+            "primeira_transacao": primeira_data,
+            "ultima_transacao": ultima_data,
+            "saldo_atual": saldo_atual,
+            "tipos_transacao": tipos
+        }
     
     def cleanup_vector_stores(self):
         """Método mantido para compatibilidade (não faz nada na versão direta)"""
-        print("[DEBUG] Método cleanup_vector_stores chamado - versão direta não usa vector stores")
+        log.debug("[DEBUG] Método cleanup_vector_stores chamado - versão direta não usa vector stores")
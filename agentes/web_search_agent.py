@@ -1,17 +1,54 @@
-from typing import Dict, Any, Optional
-from openai import OpenAI
+from typing import Dict, Any, Optional, List
+import asyncio
+import logging
+import re
+from openai import OpenAI, AsyncOpenAI
+from utils.cache_ttl import CacheTTL
 from .base_agent import BaseAgent
 
+log = logging.getLogger("orchestrator")
+
 
 class WebSearchAgent(BaseAgent):
     """Agente especializado em busca web para informações bancárias atualizadas"""
     
-    def __init__(self, client: OpenAI):
+    __slots__ = ("client", "async_client", "_cache")
+    
+    # Termos relevantes para busca bancária, compilados em uma única alternância
+    _TERMOS_BANCARIOS = (
+        'banco', 'bancário', 'bancaria', 'caixa', 'fgts', 'empréstimo', 'emprestimo',
+        'consignado', 'juros', 'taxa', 'crédito', 'credito', 'financiamento',
+        'poupança', 'poupanca', 'conta', 'cartão', 'cartao', 'financeiro',
+        'financeira', 'central', 'bacen', 'cdb', 'investimento', 'aposentadoria',
+        'pensão', 'pensao', 'saque', 'transferência', 'transferencia', 'pix'
+    )
+    _RE_TERMOS_BANCARIOS = re.compile("|".join(map(re.escape, _TERMOS_BANCARIOS)))
+    
+    # Limite de buscas simultâneas em processar_batch_async (respeita o rate limit da API)
+    MAX_BUSCAS_CONCORRENTES = 8
+    
+    # Buscas bem-sucedidas valem por alguns minutos: a mesma consulta (mesma pergunta e
+    # localização) não paga outra chamada ao gpt-4o-search-preview nesse intervalo
+    CACHE_TTL_SEGUNDOS = 600.0
+    CACHE_MAX_ENTRADAS = 256
+    
+    # Contexto base para busca bancária (prefixo fixo, favorece o cache de prompt da API)
+    _CONTEXTO_BANCARIO = (
+        "Busque informações atualizadas sobre temas bancários, financeiros e do sistema financeiro. "
+        "Foque em: Caixa Econômica Federal, bancos brasileiros, FGTS, empréstimos consignados, "
+        "taxas de juros, regulamentações bancárias, Banco Central do Brasil, e legislação financeira."
+    )
+    _CONTEXTO_PADRAO = _CONTEXTO_BANCARIO + " Foque em informações do Brasil e sistema bancário brasileiro."
+    _CONTEXTO_LOCALIZACAO = _CONTEXTO_BANCARIO + " Contextualize as informações para: {localizacao}."
+    
+    def __init__(self, client: OpenAI, async_client: Optional[AsyncOpenAI] = None):
         super().__init__(
             nome="Web Search Agent",
             descricao="Busca informações públicas e atualizadas na internet sobre temas bancários, FGTS, taxas de juros, notícias e regras relevantes para empréstimos e consignados"
         )
         self.client = client
+        self.async_client = async_client
+        self._cache = CacheTTL(max_itens=self.CACHE_MAX_ENTRADAS, ttl_segundos=self.CACHE_TTL_SEGUNDOS)
     
     def processar(self, pergunta: str, localizacao: Optional[str] = None, **kwargs) -> Dict[str, Any]:
         """
@@ -28,59 +65,112 @@ class WebSearchAgent(BaseAgent):
             # Construir a pergunta com contexto bancário
             pergunta_contextualizada = self._construir_pergunta_contextualizada(pergunta, localizacao)
             
-            print(f"[DEBUG] Executando busca web: {pergunta_contextualizada}")
+            resposta = self._cache.obter(pergunta_contextualizada)
+            if resposta is None:
+                log.debug("[DEBUG] Executando busca web: %s", pergunta_contextualizada)
+                
+                # Executar busca usando gpt-4o-search-preview
+                completion = self.client.chat.completions.create(**self._parametros_busca(pergunta_contextualizada))
+                
+                resposta = completion.choices[0].message.content
+                self._cache.armazenar(pergunta_contextualizada, resposta)
+            
+            return self._montar_resultado(pergunta, pergunta_contextualizada, localizacao, resposta)
             
-            # Executar busca usando gpt-4o-search-preview
-            completion = self.client.chat.completions.create(
-                model="gpt-4o-search-preview",
-                web_search_options={
-                    "search_context_size": "low",  # Opções: "low", "medium", "high"
-                },
-                messages=[{
-                    "role": "user",
-                    "content": pergunta_contextualizada,
-                }],
-            )
+        except Exception as e:
+            return self._resultado_erro(pergunta, e)
+    
+    async def processar_async(self, pergunta: str, localizacao: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Versão assíncrona de processar usando o AsyncOpenAI, sem ocupar uma thread durante a busca
+        
+        Sem async_client configurado, cai na implementação padrão (processar em thread).
+        """
+        if self.async_client is None:
+            return await super().processar_async(pergunta, localizacao, **kwargs)
+        
+        try:
+            pergunta_contextualizada = self._construir_pergunta_contextualizada(pergunta, localizacao)
             
-            resposta = completion.choices[0].message.content
+            resposta = self._cache.obter(pergunta_contextualizada)
+            if resposta is None:
+                log.debug("[DEBUG] Executando busca web: %s", pergunta_contextualizada)
+                
+                completion = await self.async_client.chat.completions.create(**self._parametros_busca(pergunta_contextualizada))
+                
+                resposta = completion.choices[0].message.content
+                self._cache.armazenar(pergunta_contextualizada, resposta)
             
-            return {
-                "erro": False,
-                "pergunta_original": pergunta,
-                "pergunta_processada": pergunta_contextualizada,
-                "localizacao": localizacao,
-                "resultado": resposta,
-                "mensagem": self._formatar_resultado_busca(pergunta, resposta)
-            }
+            return self._montar_resultado(pergunta, pergunta_contextualizada, localizacao, resposta)
             
         except Exception as e:
-            print(f"[ERRO] Erro na busca web: {e}")
-            return {
-                "erro": True,
-                "pergunta_original": pergunta,
-                "mensagem": f"Não foi possível realizar a busca web. Erro: {str(e)}",
-                "resultado": None
-            }
+            return self._resultado_erro(pergunta, e)
+    
+    async def processar_batch_async(self, perguntas: List[str], localizacao: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Executa várias buscas web em paralelo
+        
+        Args:
+            perguntas: Lista de perguntas para buscar na web
+            localizacao: Localização aplicada a todas as buscas (opcional)
+            
+        Returns:
+            Lista de resultados na mesma ordem das perguntas
+        """
+        semaforo = asyncio.Semaphore(self.MAX_BUSCAS_CONCORRENTES)
+        
+        async def buscar(pergunta: str) -> Dict[str, Any]:
+            async with semaforo:
+                return await self.processar_async(pergunta, localizacao)
+        
+        return await asyncio.gather(*(buscar(pergunta) for pergunta in perguntas))
+    
+    @staticmethod
+    def _parametros_busca(pergunta_contextualizada: str) -> Dict[str, Any]:
+        """Parâmetros da chamada de busca web (compartilhados pelas versões síncrona e assíncrona)"""
+        return {
+            "model": "gpt-4o-search-preview",
+            "web_search_options": {
+                "search_context_size": "low",  # Opções: "low", "medium", "high"
+            },
+            "messages": [{
+                "role": "user",
+                "content": pergunta_contextualizada,
+            }],
+        }
+    
+    def _montar_resultado(self, pergunta: str, pergunta_contextualizada: str, localizacao: Optional[str],
+                          resposta: str) -> Dict[str, Any]:
+        """Monta o dict de resultado de uma busca bem-sucedida"""
+        return {
+            "erro": False,
+            "pergunta_original": pergunta,
+            "pergunta_processada": pergunta_contextualizada,
+            "localizacao": localizacao,
+            "resultado": resposta,
+            "mensagem": self._formatar_resultado_busca(pergunta, resposta)
+        }
+    
+    @staticmethod
+    def _resultado_erro(pergunta: str, e: Exception) -> Dict[str, Any]:
+        """Monta o dict de resultado quando a busca falha"""
+        log.error("[ERRO] Erro na busca web: %s", e)
+        return {
+            "erro": True,
+            "pergunta_original": pergunta,
+            "mensagem": f"Não foi possível realizar a busca web. Erro: {str(e)}",
+            "resultado": None
+        }
     
     def _construir_pergunta_contextualizada(self, pergunta: str, localizacao: Optional[str]) -> str:
         """Constrói pergunta com contexto bancário brasileiro"""
         
-        # Contexto base para busca bancária
-        contexto_bancario = (
-            "Busque informações atualizadas sobre temas bancários, financeiros e do sistema financeiro. "
-            "Foque em: Caixa Econômica Federal, bancos brasileiros, FGTS, empréstimos consignados, "
-            "taxas de juros, regulamentações bancárias, Banco Central do Brasil, e legislação financeira."
-        )
-        
         # Adicionar localização se fornecida
         if localizacao:
-            contexto_localizacao = f" Contextualize as informações para: {localizacao}."
+            contexto = self._CONTEXTO_LOCALIZACAO.format(localizacao=localizacao)
         else:
-            contexto_localizacao = " Foque em informações do Brasil e sistema bancário brasileiro."
-        
-        pergunta_final = f"{contexto_bancario}{contexto_localizacao}\n\nPergunta: {pergunta}"
+            contexto = self._CONTEXTO_PADRAO
         
-        return pergunta_final
+        return f"{contexto}\n\nPergunta: {pergunta}"
     
     def _formatar_resultado_busca(self, pergunta: str, resultado: str) -> str:
         """Formata o resultado da busca para apresentação ao usuário"""
@@ -126,17 +216,8 @@ class WebSearchAgent(BaseAgent):
         if not pergunta or not pergunta.strip():
             return False
         
-        # Lista de termos relevantes para busca bancária
-        termos_bancarios = [
-            'banco', 'bancário', 'bancaria', 'caixa', 'fgts', 'empréstimo', 'emprestimo',
-            'consignado', 'juros', 'taxa', 'crédito', 'credito', 'financiamento',
-            'poupança', 'poupanca', 'conta', 'cartão', 'cartao', 'financeiro',
-            'financeira', 'central', 'bacen', 'cdb', 'investimento', 'aposentadoria',
-            'pensão', 'pensao', 'saque', 'transferência', 'transferencia', 'pix'
-        ]
-        
-        pergunta_lower = pergunta.lower()
-        return any(termo in pergunta_lower for termo in termos_bancarios)
+        # Uma única varredura da pergunta encontra qualquer um dos termos
+        return self._RE_TERMOS_BANCARIOS.search(pergunta.lower()) is not None
     
     def obter_temas_sugeridos(self) -> list:
         """Retorna lista de temas sugeridos para busca"""
@@ -1,90 +1,133 @@
-from agents import Agent, handoff, Runner, function_tool
+from agents import Agent, handoff, ModelSettings, Runner, function_tool, set_default_openai_client
+from openai.types.responses import ResponseTextDeltaEvent
 from agentes.emprestimo_agent import EmprestimoAgent
 from agentes.analise_risco_agent import AnaliseRiscoAgent
 from agentes.web_search_agent import WebSearchAgent
 from agentes.file_search_agent import FileSearchAgent
 from utils.historico_manager import HistoricoManager
+from utils.historico_index import HistoricoIndex
 from utils.guardrails import GuardRailsManager
+from utils.cache_ttl import CacheTTL
+from utils.semantic_cache import CacheSemantico
+from utils.token_budget import podar_por_tokens
 from utils.file_utils import carregar_prompt
-from openai import OpenAI
+from utils.openai_client import async_client, client, executar_no_loop
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import re
+from contextvars import ContextVar
+from functools import lru_cache
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import Annotated, Callable, Optional
+from pydantic import Field
+
+try:
+    # Serializador em C/Rust, bem mais rápido que o json da biblioteca padrão (opcional)
+    from orjson import dumps as _json_dumps
+except ImportError:
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# O Runner também usa o cliente compartilhado (mesmo pool de conexões das ferramentas)
+set_default_openai_client(async_client)
+
+@lru_cache(maxsize=1)
+def get_historico_manager() -> HistoricoManager:
+    """Instância única do HistoricoManager, criada no primeiro uso"""
+    return HistoricoManager(limite_mensagens_por_agente=5)
 
-historico_manager = HistoricoManager(limite_mensagens_por_agente=5)
-guardrails_manager = GuardRailsManager(client, debug=True)
+@lru_cache(maxsize=1)
+def get_guardrails_manager() -> GuardRailsManager:
+    """Instância única do GuardRailsManager, criada no primeiro uso e reaproveitando o client do módulo"""
+    return GuardRailsManager(client, debug=True)
 
 emprestimo_agent = EmprestimoAgent()
 analise_risco_agent = AnaliseRiscoAgent()
-web_search_agent = WebSearchAgent(client)
+web_search_agent = WebSearchAgent(client, async_client)
 file_search_agent = FileSearchAgent(client)
 
+# Rastros por turno em DEBUG: com o nível padrão (INFO) a formatação "%s" nem é avaliada.
+# Use LOG_LEVEL=DEBUG para ver o fluxo completo de cada mensagem.
+log = logging.getLogger("orchestrator")
+log.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+if not log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+    log.propagate = False
+
+# Contexto da sessão em execução (cpf, base_usuarios, histórico, último agente usado).
+# Cada chamada de run_agent_loop_async define o seu, isolado por task/thread.
+_contexto_sessao: ContextVar[dict] = ContextVar("contexto_sessao")
+
+# As restrições dos parâmetros entram no JSON schema da ferramenta e são validadas pelo
+# modelo pydantic que o function_tool gera no import; argumentos inválidos voltam como
+# erro para o modelo sem chegar ao EmprestimoAgent
 @function_tool
-def emprestimo_tool(cpf: str, valor: float, qtd_parcelas: int) -> str:
+async def emprestimo_tool(cpf: str, valor: Annotated[float, Field(gt=0)],
+                          qtd_parcelas: Annotated[int, Field(ge=1)]) -> str:
     """Simula empréstimo usando a lógica real do EmprestimoAgent"""
     try:
-        print(f"🏦 [EMPRESTIMO_AGENT] Processando empréstimo: CPF={cpf}, Valor=R${valor}, Parcelas={qtd_parcelas}")
-        base_usuarios = _context_data.get('base_usuarios', {})
+        log.debug("🏦 [EMPRESTIMO_AGENT] Processando empréstimo: CPF=%s, Valor=R$%s, Parcelas=%s", cpf, valor, qtd_parcelas)
+        contexto = _contexto_sessao.get({})
+        base_usuarios = contexto.get('base_usuarios', {})
         if not base_usuarios:
-            print("❌ [EMPRESTIMO_AGENT] Base de usuários não encontrada no contexto")
+            log.warning("❌ [EMPRESTIMO_AGENT] Base de usuários não encontrada no contexto")
             return "Erro interno: base de usuários não disponível."
         
-        result = emprestimo_agent.processar(cpf, valor, qtd_parcelas, base_usuarios)
-        print(f"🏦 [EMPRESTIMO_AGENT] Resultado: {result.get('aprovado', 'N/A')}")
+        result = await emprestimo_agent.processar_async(cpf, valor, qtd_parcelas, base_usuarios)
+        log.debug("🏦 [EMPRESTIMO_AGENT] Resultado: %s", result.get('aprovado', 'N/A'))
      
-        _context_data['last_agent_used'] = 'emprestimo_agent'
+        contexto['last_agent_used'] = 'emprestimo_agent'
         return result["mensagem"]
     except Exception as e:
-        print(f"❌ [EMPRESTIMO_AGENT] Erro: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ [EMPRESTIMO_AGENT] Erro: %s", e)
         return f"Erro ao processar empréstimo: {str(e)}"
 
 @function_tool
-def analise_risco_tool(cpf: str) -> str:
+async def analise_risco_tool(cpf: str) -> str:
     """Analisa risco usando a lógica real do AnaliseRiscoAgent"""
-    print(f"📊 [ANALISE_RISCO_AGENT] Analisando risco para CPF={cpf}")
-    base_usuarios = _context_data.get('base_usuarios', {})
-    historico = _context_data.get('historico', None)
-    result = analise_risco_agent.processar(cpf, base_usuarios, historico)
-    print(f"📊 [ANALISE_RISCO_AGENT] Nível de risco: {result.get('analise', {}).get('nivel_risco', 'N/A')}")
+    log.debug("📊 [ANALISE_RISCO_AGENT] Analisando risco para CPF=%s", cpf)
+    contexto = _contexto_sessao.get({})
+    base_usuarios = contexto.get('base_usuarios', {})
+    historico = contexto.get('historico', None)
+    result = await analise_risco_agent.processar_async(cpf, base_usuarios, historico)
+    log.debug("📊 [ANALISE_RISCO_AGENT] Nível de risco: %s", result.get('analise', {}).get('nivel_risco', 'N/A'))
   
-    _context_data['last_agent_used'] = 'analise_risco_agent'
+    contexto['last_agent_used'] = 'analise_risco_agent'
     return result["mensagem"]
 
 @function_tool
-def web_search_tool(pergunta: str) -> str:
+async def web_search_tool(pergunta: str) -> str:
     """Busca web usando a lógica real do WebSearchAgent"""
     try:
-        print(f"🌐 [WEB_SEARCH_AGENT] Buscando na web: {pergunta[:50]}...")
-        result = web_search_agent.processar(pergunta)
-        print("🌐 [WEB_SEARCH_AGENT] Busca realizada com sucesso")
+        log.debug("🌐 [WEB_SEARCH_AGENT] Buscando na web: %s...", pergunta[:50])
+        result = await web_search_agent.processar_async(pergunta)
+        log.debug("🌐 [WEB_SEARCH_AGENT] Busca realizada com sucesso")
        
-        _context_data['last_agent_used'] = 'web_search_agent'
+        _contexto_sessao.get({})['last_agent_used'] = 'web_search_agent'
         return result.get("mensagem", "Busca realizada com sucesso")
     except Exception as e:
-        print(f"❌ [WEB_SEARCH_AGENT] Erro: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ [WEB_SEARCH_AGENT] Erro: %s", e)
         return f"Erro ao realizar busca web: {str(e)}"
 
 @function_tool
-def file_search_tool(cpf: str, pergunta: str) -> str:
+async def file_search_tool(cpf: str, pergunta: str) -> str:
     """Busca no histórico usando a lógica real do FileSearchAgent"""
     try:
-        print(f"📁 [FILE_SEARCH_AGENT] Buscando no histórico: CPF={cpf}, Pergunta={pergunta[:50]}...")
-        result = file_search_agent.processar(cpf, pergunta)
-        print("📁 [FILE_SEARCH_AGENT] Busca no histórico realizada")
+        log.debug("📁 [FILE_SEARCH_AGENT] Buscando no histórico: CPF=%s, Pergunta=%s...", cpf, pergunta[:50])
+        result = await file_search_agent.processar_async(cpf, pergunta)
+        log.debug("📁 [FILE_SEARCH_AGENT] Busca no histórico realizada")
        
-        _context_data['last_agent_used'] = 'file_search_agent'
+        _contexto_sessao.get({})['last_agent_used'] = 'file_search_agent'
         return result.get("mensagem", "Busca no histórico realizada")
     except Exception as e:
-        print(f"❌ [FILE_SEARCH_AGENT] Erro: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ [FILE_SEARCH_AGENT] Erro: %s", e)
         return f"Erro ao buscar no histórico: {str(e)}"
 
 emprestimo_openai_agent = Agent(
@@ -119,8 +162,26 @@ file_search_openai_agent = Agent(
     tools=[file_search_tool],
 )
 
+# Atende pedidos que envolvem mais de um domínio ("meu score e as taxas atuais"): o modelo
+# emite as chamadas de ferramenta no mesmo turno e, como as ferramentas são assíncronas,
+# o Runner as executa em paralelo e devolve os resultados juntos
+consultas_combinadas_openai_agent = Agent(
+    name="Especialista em Consultas Combinadas",
+    instructions="""Você atende solicitações que envolvem mais de um assunto bancário ao mesmo tempo.
+    Identifique todas as informações pedidas e chame todas as ferramentas necessárias de uma vez, no mesmo turno.
+    Para simular empréstimo é preciso CPF, valor e quantidade de parcelas; se faltarem, pergunte antes de usar emprestimo_tool.
+    Depois reúna os resultados em uma única resposta clara e organizada por assunto.""",
+    tools=[emprestimo_tool, analise_risco_tool, web_search_tool, file_search_tool],
+    model_settings=ModelSettings(parallel_tool_calls=True),
+)
+
+# A triagem só decide o handoff (ou responde saudações); um modelo menor faz isso com
+# menos latência e custo, e os especialistas seguem no modelo padrão para a resposta final
+MODELO_TRIAGEM = os.getenv("TRIAGEM_MODEL", "gpt-4o-mini")
+
 triage_agent = Agent(
     name="Triage Agent",
+    model=MODELO_TRIAGEM,
     instructions="""Você é um assistente jurídico especializado em FGTS e empréstimos consignados da Caixa Econômica Federal.
 
     Analise a solicitação do usuário e faça handoff para o agente especialista adequado:
@@ -129,6 +190,7 @@ triage_agent = Agent(
     - Para análise de risco/perfil creditício: faça handoff para o Especialista em Análise de Risco  
     - Para informações atualizadas (taxas, notícias, regulamentações): faça handoff para o Especialista em Busca Web
     - Para histórico de transações/extratos: faça handoff para o Especialista em Histórico de Transações
+    - Para solicitações que envolvem mais de um desses assuntos: faça handoff para o Especialista em Consultas Combinadas
     
     Sempre mantenha o contexto bancário e seja cordial com o cliente.""",
     handoffs=[
@@ -136,51 +198,358 @@ triage_agent = Agent(
         handoff(analise_risco_openai_agent), 
         handoff(web_search_openai_agent),
         handoff(file_search_openai_agent),
+        handoff(consultas_combinadas_openai_agent),
     ],
 )
 
-historico_manager = HistoricoManager(limite_mensagens_por_agente=5)
+# Classificador local de intenção: quando exatamente um domínio casa, a mensagem vai
+# direto ao especialista e a rodada de handoff do triage_agent é dispensada.
+# (padrão do domínio, especialista, padrão que pede a ferramenta sem ambiguidade)
+_INTENCOES = (
+    (re.compile(r"\b(empr[eé]stimos?|parcelas?|financiamentos?|consignado)\b", re.I), emprestimo_openai_agent,
+     re.compile(r"\b(simul\w*|empr[eé]stimos?|financiamentos?|consignado)\b", re.I)),
+    (re.compile(r"\b(risco|score|perfil|cr[eé]dito)\b", re.I), analise_risco_openai_agent,
+     re.compile(r"\b(an[aá]lise de (risco|cr[eé]dito)|meu score|score de cr[eé]dito|perfil de risco)\b", re.I)),
+    (re.compile(r"\b(taxas?|not[ií]cias?|regulamenta[cç][aã]o|sel[ií]c)\b", re.I), web_search_openai_agent,
+     re.compile(r"\b(sel[ií]c|not[ií]cias?)\b", re.I)),
+    (re.compile(r"\b(extratos?|transa[cç](?:[aã]o|[oõ]es)|gastos?|hist[oó]rico)\b", re.I), file_search_openai_agent,
+     re.compile(r"\b(meus? extratos?|minhas transa[cç][oõ]es|hist[oó]rico de transa[cç][oõ]es)\b", re.I)),
+)
+
+# Mensagens curtas roteadas localmente que pedem a ferramenta sem ambiguidade ("análise de
+# risco", "meu score") levam o especialista com tool_choice fixo: a primeira chamada ao
+# modelo vai direto para a tool call, sem a rodada de decisão. O SDK volta para "auto"
+# depois que a ferramenta roda (reset_tool_choice), então a resposta final continua sendo
+# texto livre. Termos genéricos ("crédito", "perfil", "taxa") só escolhem o especialista,
+# que decide sozinho se precisa da ferramenta
+MAX_CARACTERES_FERRAMENTA_FORCADA = 200
+_RE_NUMERO = re.compile(r"\d+(?:[.,]\d+)*")
+
+# (padrão, especialista, padrão que justifica forçar a ferramenta, especialista com tool_choice fixo)
+_INTENCOES_FORCADAS = tuple(
+    (padrao, agente, explicito, agente.clone(model_settings=ModelSettings(tool_choice=agente.tools[0].name)))
+    for padrao, agente, explicito in _INTENCOES
+)
+
+def _rotear_localmente(user_message: str) -> Optional[Agent]:
+    """Especialista para a mensagem, ou None se nenhum ou mais de um domínio casar"""
+    candidatos = [
+        (agente, explicito, forcado)
+        for padrao, agente, explicito, forcado in _INTENCOES_FORCADAS
+        if padrao.search(user_message)
+    ]
+    if len(candidatos) != 1:
+        return None
+    
+    agente, explicito, forcado = candidatos[0]
+    if len(user_message) > MAX_CARACTERES_FERRAMENTA_FORCADA or not explicito.search(user_message):
+        return agente
+    # A simulação precisa de valor e parcelas; sem os dois números o especialista pergunta antes
+    if agente is emprestimo_openai_agent and len(_RE_NUMERO.findall(user_message)) < 2:
+        return agente
+    return forcado
+
+_RE_ESPACOS = re.compile(r"\s+")
 
-def run_agent_loop(user_message: str, context_data: dict = None):
-    """Executa o loop do agente com guardrails, limitação de histórico e contexto da sessão"""
+# Decisões dos guardrails por mensagem normalizada, com validade limitada
+_decisoes_guardrail = CacheTTL(max_itens=4096, ttl_segundos=600.0)
+
+def _guardrail_cached(user_message: str, normalizado: str) -> tuple:
+    """Decisão (bloqueado, mensagem_erro) dos guardrails para a mensagem
+    
+    Pedidos repetidos ("quero um empréstimo", "qual minha análise de risco") reaproveitam
+    a decisão anterior em vez de chamar de novo a moderação e o guardrail via LLM. A chave
+    é a mensagem normalizada, mas os guardrails validam o texto original. Aprovações em
+    que algum guardrail falhou (fail-open) não são memorizadas: a próxima mensagem igual
+    é verificada de novo.
+    """
+    decisao = _decisoes_guardrail.obter(normalizado)
+    if decisao is not None:
+        return decisao
+    
+    bloqueado, mensagem_erro, detalhes = get_guardrails_manager().aplicar_guardrails_entrada(user_message)
+    decisao = (bloqueado, mensagem_erro)
+    if bloqueado or not any(d.get("erro") for d in detalhes.values()):
+        _decisoes_guardrail.armazenar(normalizado, decisao)
+    return decisao
+
+def _normalizar_mensagem(user_message: str) -> str:
+    return _RE_ESPACOS.sub(" ", user_message.strip().lower())
+
+@lru_cache(maxsize=256)
+def _prefixo_sessao(cpf: str, nome: str, resumo: Optional[str] = None) -> tuple:
+    """Mensagens de sistema com o contexto da sessão (e o resumo do histórico antigo, se houver)
+    
+    Fica logo após as instruções fixas do triage_agent e antes da mensagem do usuário,
+    então turnos consecutivos compartilham o mesmo prefixo e aproveitam o cache de
+    prompt da OpenAI. O resumo só muda a cada BLOCO_RESUMO mensagens, então a tupla
+    pronta é reaproveitada por vários turnos da mesma sessão.
+    """
+    contexto = {"role": "system", "content": f"Contexto da sessão: CPF={cpf}, Nome={nome}"}
+    if not resumo:
+        return (contexto,)
+    return (contexto, {"role": "system", "content": f"Resumo da conversa anterior: {resumo}"})
+
+MAX_RESPOSTAS_EXATAS = 512
+TTL_RESPOSTAS_SEGUNDOS = 600.0
+
+# Cache exato (cpf + pergunta normalizada) consultado antes do semântico: repetições
+# literais nem chegam a pagar a chamada de embedding
+_respostas_exatas = CacheTTL(MAX_RESPOSTAS_EXATAS, TTL_RESPOSTAS_SEGUNDOS)
+
+def _ultima_resposta(historico: list) -> str:
+    """Conteúdo da última resposta do assistente no histórico ("" se não houver)"""
+    for mensagem in reversed(historico):
+        if mensagem.get("role") == "assistant":
+            return mensagem.get("content") or ""
+    return ""
+
+def _chave_resposta_exata(cpf: str, ultima_resposta: str, normalizada: str) -> str:
+    """Chave do cache exato: a mesma pergunta só casa no mesmo estado da conversa
+    
+    Respostas curtas dependem do que o assistente acabou de dizer ("sim", "10 parcelas"
+    confirmam a simulação da vez), então a última resposta entra na chave junto com a pergunta.
+    """
+    chave = hashlib.blake2b(digest_size=16)
+    for parte in (cpf, ultima_resposta, normalizada):
+        chave.update(parte.encode("utf-8"))
+        chave.update(b"\x00")
+    return chave.hexdigest()
+
+MODELO_EMBEDDING = "text-embedding-3-small"
+
+cache_semantico = CacheSemantico(limiar=0.95)
+
+# Valores por extenso ("cinco mil", "doze parcelas") também mudam a resposta
+_RE_NUMERO_EXTENSO = re.compile(
+    r"\b(zero|uma?|dois|duas|tr[eê]s|quatro|cinco|seis|sete|oito|nove|dez|onze|doze|treze|"
+    r"c?atorze|quinze|dezesseis|dezessete|dezoito|dezenove|vinte|trinta|quarenta|cinquenta|"
+    r"sessenta|setenta|oitenta|noventa|cem|cento|(?:duz|trez|quatroc|quinh|seisc|setec|oitoc|novec)ent[oa]s|mil|milh[aã]o|milh[oõ]es|mei[oa])\b"
+)
+
+def _assinatura_semantica(normalizada: str, ultima_resposta: str) -> tuple:
+    """Parte da pergunta que precisa ser idêntica para um acerto no cache semântico
+    
+    Números (em algarismos ou por extenso) e a última resposta do assistente ficam fora do
+    embedding, que só compara o texto do usuário: "sim" depois de duas simulações diferentes
+    tem o mesmo embedding, mas não a mesma assinatura.
+    """
+    return (
+        tuple(_RE_NUMERO.findall(normalizada)),
+        tuple(_RE_NUMERO_EXTENSO.findall(normalizada)),
+        hashlib.blake2b(ultima_resposta.encode("utf-8"), digest_size=16).digest(),
+    )
+
+async def _embedding_pergunta(texto: str) -> Optional[list]:
+    """Embedding da pergunta para o cache semântico (None se a chamada falhar)"""
+    try:
+        resposta = await async_client.embeddings.create(model=MODELO_EMBEDDING, input=texto)
+        return resposta.data[0].embedding
+    except Exception as e:
+        log.error("[ERRO] Erro ao gerar embedding: %s", e)
+        return None
+
+LIMITE_HISTORICO = 15
+MENSAGENS_RECENTES = 10
+BLOCO_RESUMO = 10
+MAX_TURNOS_JANELA = int(os.getenv("HISTORICO_MAX_TURNOS", "10"))
+MAX_TOKENS_HISTORICO = int(os.getenv("HISTORICO_MAX_TOKENS", "4000"))
+MAX_RESUMOS_EM_CACHE = 256
+TTL_RESUMOS_SEGUNDOS = 3600.0
+
+# O resumo de um trecho fixo não muda; a validade só limita quanto tempo a memória fica ocupada
+_resumos_cache = CacheTTL(MAX_RESUMOS_EM_CACHE, TTL_RESUMOS_SEGUNDOS)
+
+def _dividir_historico(historico: list) -> tuple:
+    """Separa o histórico em (antigas, recentes) para o resumo
+    
+    O corte avança em blocos de BLOCO_RESUMO mensagens, então o trecho resumido só muda
+    a cada alguns turnos e o resumo em cache é reaproveitado entre eles.
+    """
+    if len(historico) <= LIMITE_HISTORICO:
+        return [], historico
+    corte = (len(historico) - MENSAGENS_RECENTES) // BLOCO_RESUMO * BLOCO_RESUMO
+    return historico[:corte], historico[corte:]
+
+def _janela_deslizante(antigas: list, recentes: list, indice: Optional[HistoricoIndex] = None) -> list:
+    """Mensagens de sistema de todo o histórico + no máximo os últimos MAX_TURNOS_JANELA pares
+    
+    Garante um teto fixo de mensagens de conversa por requisição, independente do tamanho
+    da sessão, sem perder instruções de sistema (ex.: CPF da sessão) que ficaram no trecho
+    antigo e resumido. Com o índice do histórico (mantido pelo main.py a cada turno), as
+    mensagens de sistema saem dele em vez de uma varredura do trecho antigo.
+    """
+    limite = 2 * MAX_TURNOS_JANELA
+    conversa = [i for i, msg in enumerate(recentes) if msg.get("role") != "system"]
+    corte = conversa[-limite] if len(conversa) > limite else 0
+    if indice is not None:
+        sistema = indice.mensagens_sistema(len(antigas) + corte)
+    else:
+        sistema = [msg for msg in (*antigas, *recentes[:corte]) if msg.get("role") == "system"]
+    return [*sistema, *recentes[corte:]]
+
+_PAPEIS_ENTRADA = frozenset(("system", "user", "assistant"))
+
+def _mensagens_para_entrada(historico: list) -> list:
+    """Converte mensagens do histórico salvo em itens de entrada do Runner (sem o campo agent)
+    
+    Mensagens que já estão no formato {role, content} (usuário e sistema) são repassadas
+    como estão; só as que carregam campos extras, como as respostas com agent, são copiadas.
+    """
+    return [
+        msg if len(msg) == 2 else {"role": msg["role"], "content": msg["content"]}
+        for msg in historico
+        if msg.get("role") in _PAPEIS_ENTRADA and msg.get("content")
+    ]
+
+async def _resumir_historico(antigas: list) -> Optional[str]:
+    """Resume as mensagens antigas com um modelo barato, uma vez por trecho (cache por hash)"""
+    if not antigas:
+        return None
+    
+    chave = hashlib.sha256(_json_dumps(_mensagens_para_entrada(antigas))).hexdigest()
+    resumo = _resumos_cache.obter(chave)
+    if resumo is not None:
+        return resumo
+    
     try:
-        print("🛡️ [GUARDRAILS] Verificando segurança da mensagem...")
-        bloqueado, mensagem_erro = guardrails_manager.aplicar_guardrails(user_message)
+        transcricao = "\n".join(f"{m['role']}: {m['content']}" for m in _mensagens_para_entrada(antigas))
+        resposta = await async_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": (
+                    "Resuma a conversa a seguir entre um cliente e o atendimento bancário da Caixa. "
+                    "Preserve valores, prazos, pedidos do cliente e decisões tomadas. Seja conciso."
+                )},
+                {"role": "user", "content": transcricao}
+            ],
+            max_tokens=400,
+            temperature=0.0
+        )
+        resumo = resposta.choices[0].message.content.strip()
+    except Exception as e:
+        log.error("[ERRO] Erro ao resumir histórico: %s", e)
+        return None
+    
+    _resumos_cache.armazenar(chave, resumo)
+    return resumo
+
+async def run_agent_loop_async(user_message: str, context_data: dict = None,
+                               ao_receber_delta: Optional[Callable[[str], None]] = None):
+    """Executa o loop do agente com guardrails, limitação de histórico e contexto da sessão
+    
+    As ferramentas são assíncronas, então quando o modelo emite várias chamadas de
+    ferramenta no mesmo turno o Runner as executa em paralelo (asyncio.gather) e o
+    turno custa a latência da mais lenta, não a soma de todas.
+    
+    Com ao_receber_delta, a resposta é transmitida via Runner.run_streamed e cada trecho
+    de texto é entregue ao callback assim que chega; o texto completo continua sendo
+    retornado ao final.
+    
+    O resumo do histórico antigo e o embedding do cache semântico não dependem dos
+    guardrails, então são disparados antes deles e as três chamadas correm em paralelo;
+    se a mensagem for bloqueada (ou vier do cache) as tarefas pendentes são canceladas.
+    """
+    contexto = context_data or {}
+    token = _contexto_sessao.set(contexto)
+    tarefa_resumo = tarefa_embedding = None
+    try:
+        normalizada = _normalizar_mensagem(user_message)
+        
+        # Só respostas de mensagens que já passaram pelos guardrails entram no cache exato,
+        # então um acerto pode ser devolvido antes de verificá-los de novo
+        cpf = contexto.get('cpf')
+        historico_original = contexto.get('historico', [])
+        ultima_resposta = _ultima_resposta(historico_original)
+        chave_exata = _chave_resposta_exata(cpf, ultima_resposta, normalizada) if cpf else None
+        if chave_exata is not None:
+            em_cache = _respostas_exatas.obter(chave_exata)
+            if em_cache is not None:
+                log.debug("⚡ [CACHE] Pergunta idêntica respondida recentemente, reaproveitando resposta")
+                return em_cache
+        
+        antigas, recentes = _dividir_historico(historico_original)
+        if context_data and antigas:
+            tarefa_resumo = asyncio.create_task(_resumir_historico(antigas))
+        if cpf:
+            tarefa_embedding = asyncio.create_task(_embedding_pergunta(user_message))
+        
+        log.debug("🛡️ [GUARDRAILS] Verificando segurança da mensagem...")
+        bloqueado, mensagem_erro = await asyncio.to_thread(_guardrail_cached, user_message, normalizada)
         if bloqueado:
-            print(f"🚫 [GUARDRAIL] Mensagem bloqueada: {mensagem_erro}")
+            log.info("🚫 [GUARDRAIL] Mensagem bloqueada: %s", mensagem_erro)
             return mensagem_erro, "guardrail"
         
-        global _context_data
-        _context_data = context_data or {}
-        _context_data['last_agent_used'] = 'triage_agent' 
+        contexto['last_agent_used'] = 'triage_agent' 
         
-        print(f"🎯 [TRIAGE_AGENT] Processando mensagem: {user_message[:50]}...")
+        # Valores, parcelas e o ponto da conversa mudam a resposta: o cache semântico só casa
+        # perguntas com a mesma assinatura, por mais parecido que seja o resto do texto
+        assinatura = _assinatura_semantica(normalizada, ultima_resposta)
         
-        historico_original = _context_data.get('historico', [])
+        embedding = await tarefa_embedding if tarefa_embedding is not None else None
+        if embedding is not None:
+            em_cache = cache_semantico.buscar(cpf, embedding, assinatura)
+            if em_cache is not None:
+                log.debug("⚡ [CACHE] Pergunta semelhante respondida recentemente, reaproveitando resposta")
+                return em_cache
         
-        if len(historico_original) > 15:  
-            print("⚠️ [HISTORICO] Histórico grande detectado, aplicando limitação via HistoricoManager...")
-            print(f"📊 [HISTORICO] Histórico disponível: {len(historico_original)} mensagens")
+        log.debug("🎯 [TRIAGE_AGENT] Processando mensagem: %s...", user_message[:50])
+        
+        if len(historico_original) > LIMITE_HISTORICO:  
+            log.debug("⚠️ [HISTORICO] Histórico grande detectado, resumindo mensagens antigas...")
+            log.debug("📊 [HISTORICO] Histórico disponível: %d mensagens (%d resumidas)", len(historico_original), len(antigas))
         else:
-            print(f"📊 [HISTORICO] Histórico OK: {len(historico_original)} mensagens")
+            log.debug("📊 [HISTORICO] Histórico OK: %d mensagens", len(historico_original))
         
         if context_data:
-            context_message = f"Contexto da sessão: CPF={context_data.get('cpf', '')}, Nome={context_data.get('nome', '')}"
-            full_message = f"{context_message}\n\nUsuário: {user_message}"
+            resumo = await tarefa_resumo if tarefa_resumo is not None else None
+            prefixo = _prefixo_sessao(context_data.get('cpf', ''), context_data.get('nome', ''), resumo)
+            # O índice só vale se descreve exatamente a lista de histórico desta chamada
+            indice = contexto.get('historico_indice')
+            if indice is not None and indice.mensagens is not historico_original:
+                indice = None
+            janela = podar_por_tokens(_mensagens_para_entrada(_janela_deslizante(antigas, recentes, indice)), MAX_TOKENS_HISTORICO)
+            entrada = [*prefixo, *janela, {"role": "user", "content": user_message}]
         else:
-            full_message = user_message
+            entrada = user_message
             
-        result = Runner.run_sync(triage_agent, full_message)
+        agente_inicial = _rotear_localmente(user_message)
+        if agente_inicial is not None:
+            log.debug("🧭 [ROTEAMENTO] Intenção identificada localmente: %s", agente_inicial.name)
+        else:
+            agente_inicial = triage_agent
+            
+        if ao_receber_delta is None:
+            result = await Runner.run(agente_inicial, entrada)
+        else:
+            result = Runner.run_streamed(agente_inicial, entrada)
+            async for evento in result.stream_events():
+                if evento.type == "raw_response_event" and isinstance(evento.data, ResponseTextDeltaEvent):
+                    ao_receber_delta(evento.data.delta)
+        
+        agent_used = contexto.get('last_agent_used', 'triage_agent')
+        log.debug("✅ [RESULTADO] Agente usado: %s", agent_used)
         
-        agent_used = _context_data.get('last_agent_used', 'triage_agent')
-        print(f"✅ [RESULTADO] Agente usado: {agent_used}")
+        # Respostas que passaram por ferramentas (simulação, análise de risco, busca) dependem
+        # de dados que mudam; só a conversa direta com a triagem é reaproveitada
+        if agent_used == 'triage_agent' and result.final_output:
+            if chave_exata is not None:
+                _respostas_exatas.armazenar(chave_exata, (result.final_output, agent_used))
+            if embedding is not None:
+                cache_semantico.armazenar(cpf, embedding, result.final_output, agent_used, assinatura)
         
         return result.final_output, agent_used
         
     except Exception as e:
-        print(f"[ERRO] Erro no run_agent_loop: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("[ERRO] Erro no run_agent_loop: %s", e)
         return "Desculpe, ocorreu um erro interno. Tente novamente.", "assistant_erro"
+    finally:
+        for tarefa in (tarefa_resumo, tarefa_embedding):
+            if tarefa is not None and not tarefa.done():
+                tarefa.cancel()
+        _contexto_sessao.reset(token)
 
-_context_data = {}
+def run_agent_loop(user_message: str, context_data: dict = None,
+                   ao_receber_delta: Optional[Callable[[str], None]] = None):
+    """Entrada síncrona de run_agent_loop_async, usada pelo loop interativo do main.py"""
+    return executar_no_loop(run_agent_loop_async(user_message, context_data, ao_receber_delta))
@@ -1,10 +1,15 @@
+import asyncio
+import logging
 import os
+import time
 from dotenv import load_dotenv
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure, AutoReconnect
 
 load_dotenv()
 
+log = logging.getLogger("orchestrator")
+
 MONGO_URI        = os.getenv("MONGO_URI")
 MONGO_DB         = os.getenv("MONGO_DB")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION")
@@ -14,19 +19,29 @@ db = None
 colecao = None
 conexao_disponivel = False
 
+# Um ping bem-sucedido vale por este intervalo; falhas de operação invalidam antes
+INTERVALO_VERIFICACAO_SEGUNDOS = 30.0
+_ultima_verificacao = 0.0
+
 def inicializar_conexao():
     """Tenta inicializar a conexão com o Cosmos DB"""
-    global client, db, colecao, conexao_disponivel
+    global client, db, colecao, conexao_disponivel, _ultima_verificacao
     
     try:
         client = MongoClient(MONGO_URI, 
                            serverSelectionTimeoutMS=10000,
                            connectTimeoutMS=10000,
-                           socketTimeoutMS=10000)
+                           socketTimeoutMS=10000,
+                           maxPoolSize=200,
+                           minPoolSize=10,
+                           retryReads=True,
+                           compressors="zlib")
         client.admin.command("ping")
         db = client[MONGO_DB]
         colecao = db[MONGO_COLLECTION]
+        _criar_indices()
         conexao_disponivel = True
+        _ultima_verificacao = time.monotonic()
         print("Conectado ao CosmosDB")
         return True
     except Exception as e:
@@ -35,41 +50,67 @@ def inicializar_conexao():
         conexao_disponivel = False
         return False
 
+def _criar_indices():
+    """Garante os índices usados pelas consultas por CPF e pelas agregações por agente
+    
+    create_index é idempotente; falhas (ex.: índice multikey composto não suportado pela
+    conta do Cosmos DB) são apenas registradas para não impedir a conexão.
+    """
+    indices = [
+        ([("cpf", 1)], {"unique": True}),
+        ([("cpf", 1), ("historico.agent", 1), ("historico.role", 1)], {}),
+    ]
+    for chaves, opcoes in indices:
+        try:
+            colecao.create_index(chaves, **opcoes)
+        except Exception as e:
+            print(f"[AVISO] Não foi possível criar índice {chaves}: {str(e)[:100]}...")
+
 def verificar_conexao():
-    global conexao_disponivel
+    global conexao_disponivel, _ultima_verificacao
     if not conexao_disponivel:
         return False
     
+    agora = time.monotonic()
+    if agora - _ultima_verificacao < INTERVALO_VERIFICACAO_SEGUNDOS:
+        return True
+    
     try:
         client.admin.command("ping")
+        _ultima_verificacao = agora
         return True
     except Exception:
-        print("[AVISO] Conexão com Cosmos DB perdida.")
+        log.warning("[AVISO] Conexão com Cosmos DB perdida.")
         conexao_disponivel = False
         return False
 
+def invalidar_verificacao():
+    """Força um novo ping na próxima verificar_conexao (chamar quando uma operação falhar)"""
+    global _ultima_verificacao
+    _ultima_verificacao = 0.0
+
 def buscar_mensagens_por_agente_db(cpf: str, agente: str) -> list:
     """Busca mensagens de um agente específico no Cosmos DB"""
     if not verificar_conexao():
         return []
     
     try:
-        # Buscar documento do CPF
-        documento = colecao.find_one({"cpf": cpf})
-        if not documento or "historico" not in documento:
-            return []
-        
-        # Filtrar mensagens do agente
-        mensagens_agente = []
-        for mensagem in documento["historico"]:
-            if (mensagem.get("role") == "assistant" and 
-                mensagem.get("agent") == agente):
-                mensagens_agente.append(mensagem)
+        # Filtrar no servidor para trafegar apenas as mensagens do agente
+        pipeline = [
+            {"$match": {"cpf": cpf}},
+            {"$unwind": "$historico"},
+            {"$match": {
+                "historico.role": "assistant",
+                "historico.agent": agente
+            }},
+            {"$replaceRoot": {"newRoot": "$historico"}}
+        ]
         
-        return mensagens_agente
+        return list(colecao.aggregate(pipeline))
         
     except Exception as e:
-        print(f"[ERRO] Erro ao buscar mensagens por agente: {e}")
+        log.error("[ERRO] Erro ao buscar mensagens por agente: %s", e)
+        invalidar_verificacao()
         return []
 
 
@@ -97,7 +138,8 @@ def listar_agentes_usados_db(cpf: str) -> list:
         return agentes
         
     except Exception as e:
-        print(f"[ERRO] Erro ao listar agentes: {e}")
+        log.error("[ERRO] Erro ao listar agentes: %s", e)
+        invalidar_verificacao()
         return []
 
 
@@ -127,8 +169,24 @@ def estatisticas_agentes_db(cpf: str) -> dict:
         return estatisticas
         
     except Exception as e:
-        print(f"[ERRO] Erro ao obter estatísticas: {e}")
+        log.error("[ERRO] Erro ao obter estatísticas: %s", e)
+        invalidar_verificacao()
         return {}
 
 
+async def buscar_mensagens_por_agente_db_async(cpf: str, agente: str) -> list:
+    """Versão assíncrona de buscar_mensagens_por_agente_db, executada em thread do pool"""
+    return await asyncio.to_thread(buscar_mensagens_por_agente_db, cpf, agente)
+
+
+async def listar_agentes_usados_db_async(cpf: str) -> list:
+    """Versão assíncrona de listar_agentes_usados_db, executada em thread do pool"""
+    return await asyncio.to_thread(listar_agentes_usados_db, cpf)
+
+
+async def estatisticas_agentes_db_async(cpf: str) -> dict:
+    """Versão assíncrona de estatisticas_agentes_db, executada em thread do pool"""
+    return await asyncio.to_thread(estatisticas_agentes_db, cpf)
+
+
 inicializar_conexao()
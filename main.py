@@ -1,14 +1,11 @@
 
-import os
 from dotenv import load_dotenv
-from openai import OpenAI
 from pathlib import Path
-from utils.file_utils import carregar_usuarios, validar_cpf, carregar_historico, salvar_historico, adicionar_cpf_ao_contexto, enviar_boas_vindas
+from utils.file_utils import carregar_usuarios, validar_cpf, carregar_historico, salvar_historico, agendar_mensagens_append, aguardar_gravacoes, adicionar_cpf_ao_contexto, enviar_boas_vindas
 from agents_openai import run_agent_loop
+from utils.historico_index import HistoricoIndex
 
 load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
 HISTORY_DIR = Path("chat_history")
 
 def main():
@@ -30,6 +27,11 @@ def main():
     else:
         adicionar_cpf_ao_contexto(historico, cpf)
         print(f"\nAssistente: Olá novamente, {nome}! Como posso ajudá-lo hoje? 😊\n")
+    
+    # Índice mantido junto com o histórico (a lista é a mesma): cada turno só acrescenta
+    # as mensagens novas, e o loop do agente consulta o índice em vez de refiltrar tudo
+    indice_historico = HistoricoIndex.de_lista(historico)
+    historico = indice_historico.mensagens
     try:
         while True:
             pergunta = input("Você: ").strip()
@@ -39,24 +41,41 @@ def main():
             
             print("\n🔄 [MAIN] Processando mensagem via OpenAI Agents...")
             
-            context_data = {"cpf": cpf, "nome": nome, "base_usuarios": base_usuarios, "historico": historico}
-            resposta_texto, agente_usado = run_agent_loop(pergunta, context_data)
+            context_data = {"cpf": cpf, "nome": nome, "base_usuarios": base_usuarios, "historico": historico,
+                            "historico_indice": indice_historico}
+            transmitido = []
             
+            def exibir_delta(delta: str) -> None:
+                if not transmitido:
+                    print("\nAssistente: ", end="", flush=True)
+                transmitido.append(delta)
+                print(delta, end="", flush=True)
+            
+            resposta_texto, agente_usado = run_agent_loop(pergunta, context_data, exibir_delta)
+            
+            if transmitido:
+                print("\n")
             print(f"💾 [MAIN] Salvando no histórico com agent: {agente_usado}")
-            print(f"\nAssistente: {resposta_texto}\n")
+            # Se a execução falhou no meio do streaming, a resposta salva (a mensagem de erro)
+            # não é o que foi exibido: mostra a resposta inteira também
+            if resposta_texto != "".join(transmitido):
+                print(f"\nAssistente: {resposta_texto}\n")
             
             # Atualizar histórico com o agente correto
-            historico.extend([
+            indice_historico.extend([
                 {"role": "user", "content": pergunta},
                 {"role": "assistant", "content": resposta_texto, "agent": agente_usado}
             ])
             
-            salvar_historico(cpf, historico, HISTORY_DIR)
-            print(f"✅ [MAIN] Histórico salvo com {len(historico)} mensagens")
+            # Gravação roda em segundo plano enquanto o usuário digita a próxima mensagem
+            agendar_mensagens_append(cpf, historico[-2:], HISTORY_DIR, historico)
+            print(f"✅ [MAIN] Histórico enviado para gravação com {len(historico)} mensagens")
     except KeyboardInterrupt:
         print("\nSistema encerrado pelo usuário.")
     except Exception as e:
         print(f"[ERRO] Erro inesperado: {e}")
+    finally:
+        aguardar_gravacoes()
 
 if __name__ == "__main__":
     main()
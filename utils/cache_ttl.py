@@ -0,0 +1,42 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class CacheTTL:
+    """
+    Cache LRU com expiração por tempo, seguro entre threads
+
+    Usado para resultados de chamadas remotas que podem ser reaproveitados por alguns
+    minutos (ex.: decisões dos guardrails): um acerto evita a ida à rede por completo.
+    """
+
+    def __init__(self, max_itens: int = 512, ttl_segundos: float = 600.0):
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self._itens: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave: Hashable) -> Optional[Any]:
+        """Valor armazenado para a chave, ou None se ausente ou expirado"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            if time.monotonic() - item[0] >= self.ttl_segundos:
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return item[1]
+
+    def armazenar(self, chave: Hashable, valor: Any) -> None:
+        with self._lock:
+            self._itens[chave] = (time.monotonic(), valor)
+            self._itens.move_to_end(chave)
+            if len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
@@ -1,161 +1,449 @@
+import atexit
 import json
+import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from openai import OpenAI
+from types import MappingProxyType
+from typing import Mapping, Optional
 from dotenv import load_dotenv
-from db import colecao, conexao_disponivel, verificar_conexao
+from db import colecao, conexao_disponivel, verificar_conexao, invalidar_verificacao
+from utils.historico_index import HistoricoIndex
+from utils.openai_client import async_client, client, executar_no_loop
+
+try:
+    # Serializador em C/Rust, bem mais rápido que o json da biblioteca padrão (opcional)
+    import orjson
+    _json_loads = orjson.loads
+    
+    def _json_linha(mensagem) -> bytes:
+        return orjson.dumps(mensagem) + b"\n"
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_linha(mensagem) -> bytes:
+        return json.dumps(mensagem, ensure_ascii=False).encode("utf-8") + b"\n"
+
+# Mesmo logger do orquestrador (nível via LOG_LEVEL); mensagens por turno não formatam
+# nada quando o nível configurado está acima delas
+log = logging.getLogger("orchestrator")
 
-# Configurar cliente OpenAI para boas-vindas
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# Boas-vindas é uma saudação curta guiada pelo prompt base; um modelo menor responde
+# igual com menos latência e custo
+MODELO_BOAS_VINDAS = "gpt-4o-mini"
+
+
+@lru_cache(maxsize=1)
+def _carregar_prompt_cache(arquivo: str, mtime_ns: int) -> str:
+    with open(arquivo, "rb") as f:
+        return _json_loads(f.read())["base_prompt"]
 
 
-def carregar_prompt():
-    with open("prompt.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-        return data["base_prompt"]
+def carregar_prompt(arquivo: str = "prompt.json") -> str:
+    """Prompt base; relido apenas quando o mtime de prompt.json muda"""
+    return _carregar_prompt_cache(arquivo, os.stat(arquivo).st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def _mensagem_sistema_base(prompt_base: str) -> tuple:
+    return ({"role": "system", "content": prompt_base},)
+
+
+def _mensagens_base() -> tuple:
+    """Mensagem de sistema com o prompt base, remontada só quando o prompt muda"""
+    return _mensagem_sistema_base(carregar_prompt())
 
 
 def carregar_historico(cpf: str, history_dir: Path) -> list:
-    """Carrega histórico do banco ou arquivo local"""
+    """Carrega histórico do banco ou arquivo local
+    
+    Se o arquivo local ficou à frente do banco (gravações feitas durante uma falha do
+    Cosmos DB), ele é a cópia completa: é devolvido e enviado de volta ao banco.
+    """
     if conexao_disponivel and verificar_conexao():
+        if _marcador_pendente(cpf, history_dir).exists():
+            historico_local = _ler_historico_local(cpf, history_dir)
+            if historico_local:
+                _sincronizar_completo(cpf, historico_local, history_dir)
+                return historico_local
         try:
             documento = colecao.find_one({"cpf": cpf})
             if documento and "historico" in documento:
-                print(f"[LOG] Histórico carregado do Cosmos DB para CPF: {cpf}")
+                log.info("[LOG] Histórico carregado do Cosmos DB para CPF: %s", cpf)
                 return documento["historico"]
         except Exception as e:
-            print(f"[ERRO] Erro ao carregar do Cosmos DB: {e}")
+            log.error("[ERRO] Erro ao carregar do Cosmos DB: %s", e)
+            invalidar_verificacao()
     
-    caminho = history_dir / f"{cpf}.json"
+    return _ler_historico_local(cpf, history_dir)
+
+
+def _ler_historico_local(cpf: str, history_dir: Path) -> list:
+    caminho = history_dir / f"{cpf}.jsonl"
     if caminho.exists():
-        print(f"[LOG] Histórico carregado do arquivo local para CPF: {cpf}")
-        with open(caminho, "r", encoding="utf-8") as f:
-            return json.load(f)
+        log.info("[LOG] Histórico carregado do arquivo local para CPF: %s", cpf)
+        with open(caminho, "rb") as f:
+            return _ler_jsonl(f, caminho)
+    
+    # Formato antigo: lista JSON completa em {cpf}.json
+    caminho_legado = history_dir / f"{cpf}.json"
+    if caminho_legado.exists():
+        log.info("[LOG] Histórico carregado do arquivo local para CPF: %s", cpf)
+        with open(caminho_legado, "rb") as f:
+            dados = f.read()
+        # Arquivo vazio (ex.: escrita interrompida) equivale a histórico vazio
+        return _json_loads(dados) if dados.strip() else []
     
     return []
 
 
+def _ler_jsonl(f, caminho: Path) -> list:
+    mensagens = []
+    for numero, linha in enumerate(f, 1):
+        if not linha.strip():
+            continue
+        try:
+            mensagens.append(_json_loads(linha))
+        except ValueError:
+            # Linha cortada por uma gravação interrompida: descartada para não impedir a sessão
+            log.warning("[AVISO] Linha %d inválida em %s ignorada", numero, caminho)
+    return mensagens
+
+
+def _termina_em_linha_completa(caminho: Path) -> bool:
+    try:
+        with open(caminho, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    except OSError:
+        # Arquivo inexistente ou vazio
+        return True
+
+
+def _escrever_jsonl(caminho: Path, mensagens: list, modo: str) -> None:
+    dados = b"".join(_json_linha(m) for m in mensagens)
+    if modo == "a" and not _termina_em_linha_completa(caminho):
+        # Isola o resto de uma linha cortada em vez de emendar a próxima mensagem nele
+        dados = b"\n" + dados
+    with open(caminho, modo + "b") as f:
+        f.write(dados)
+
+
+def _marcador_pendente(cpf: str, history_dir: Path) -> Path:
+    """Arquivo que indica que {cpf}.jsonl é uma cópia completa ainda não enviada ao banco
+    
+    Fica em disco (e não em memória) para que a reconciliação em carregar_historico
+    aconteça mesmo depois de reiniciar o processo com o banco fora do ar.
+    """
+    return history_dir / f"{cpf}.pendente"
+
+
+def _sincronizar_completo(cpf: str, historico: list, history_dir: Path) -> bool:
+    """Substitui o documento do CPF no Cosmos DB pelo histórico inteiro (True se gravou)"""
+    try:
+        documento = {
+            "cpf": cpf,
+            "historico": historico,
+            "ultima_atualizacao": datetime.now().isoformat(),
+            "total_mensagens": len(historico)
+        }
+        
+        resultado = colecao.replace_one(
+            {"cpf": cpf}, 
+            documento, 
+            upsert=True
+        )
+        
+        if resultado.upserted_id or resultado.modified_count > 0 or resultado.matched_count > 0:
+            log.info("[LOG] Histórico salvo no Cosmos DB")
+            # O banco voltou a ter a cópia completa: nada mais fica pendente
+            _marcador_pendente(cpf, history_dir).unlink(missing_ok=True)
+            return True
+            
+    except Exception as e:
+        log.error("[ERRO] Erro ao salvar no Cosmos DB: %s", e)
+        invalidar_verificacao()
+    return False
+
+
 def salvar_historico(cpf: str, historico: list, history_dir: Path) -> None:
     """Salva histórico no banco ou arquivo local"""
     if conexao_disponivel and verificar_conexao():
-        try:
-            documento = {
-                "cpf": cpf,
-                "historico": historico,
-                "ultima_atualizacao": datetime.now().isoformat(),
-                "total_mensagens": len(historico)
-            }
-            
-            resultado = colecao.replace_one(
-                {"cpf": cpf}, 
-                documento, 
-                upsert=True
-            )
-            
-            if resultado.upserted_id or resultado.modified_count > 0:
-                print("[LOG] Histórico salvo no Cosmos DB")
+        if _sincronizar_completo(cpf, historico, history_dir):
+            return
+    
+    log.info("[LOG] Salvando em arquivo local..")
+    _escrever_jsonl(history_dir / f"{cpf}.jsonl", historico, "w")
+    _marcador_pendente(cpf, history_dir).touch()
+
+
+def salvar_mensagens_append(cpf: str, novas_mensagens: list, history_dir: Path,
+                            historico: Optional[list] = None) -> None:
+    """Acrescenta apenas as mensagens novas ao histórico, sem regravar o histórico inteiro
+    
+    No Cosmos DB usa $push com $each; localmente acrescenta linhas ao {cpf}.jsonl. Assim o
+    custo de cada turno independe do tamanho da conversa.
+    
+    `historico` é o histórico completo já com as novas mensagens. Na primeira gravação
+    local desde a última sincronização ele é gravado inteiro, então {cpf}.jsonl continua
+    uma cópia completa (e não só os turnos da falha); o marcador em disco faz o arquivo
+    voltar ao banco assim que ele estiver disponível.
+    """
+    pendente = _marcador_pendente(cpf, history_dir)
+    if conexao_disponivel and verificar_conexao():
+        if pendente.exists() and historico is not None:
+            # O banco está atrás do arquivo local: regrava o documento inteiro
+            if _sincronizar_completo(cpf, historico, history_dir):
                 return
+        else:
+            try:
+                resultado = colecao.update_one(
+                    {"cpf": cpf},
+                    {
+                        "$push": {"historico": {"$each": novas_mensagens}},
+                        "$set": {"ultima_atualizacao": datetime.now().isoformat()},
+                        "$inc": {"total_mensagens": len(novas_mensagens)}
+                    },
+                    upsert=True
+                )
                 
+                if resultado.upserted_id or resultado.modified_count > 0:
+                    log.info("[LOG] Histórico salvo no Cosmos DB")
+                    return
+                    
+            except Exception as e:
+                log.error("[ERRO] Erro ao salvar no Cosmos DB: %s", e)
+                invalidar_verificacao()
+    
+    log.info("[LOG] Salvando em arquivo local..")
+    caminho = history_dir / f"{cpf}.jsonl"
+    if pendente.exists():
+        # O arquivo já é a cópia completa: basta acrescentar
+        _escrever_jsonl(caminho, novas_mensagens, "a")
+        return
+    
+    if historico is not None:
+        _escrever_jsonl(caminho, historico, "w")
+        pendente.touch()
+        return
+    
+    # Sem o histórico completo, apenas acrescenta (o arquivo pode não ter os turnos do banco)
+    caminho_legado = history_dir / f"{cpf}.json"
+    if not caminho.exists() and caminho_legado.exists():
+        # Migra o histórico do formato antigo antes do primeiro append
+        with open(caminho_legado, "rb") as f:
+            _escrever_jsonl(caminho, _json_loads(f.read()), "w")
+    _escrever_jsonl(caminho, novas_mensagens, "a")
+
+
+# Gravação em segundo plano: appends do mesmo CPF que chegam enquanto outro ainda está
+# na fila são agrupados em uma única escrita, e um lock por CPF mantém a ordem dos turnos
+_gravador = ThreadPoolExecutor(max_workers=2, thread_name_prefix="historico")
+_appends_pendentes: dict = {}
+_cpfs_na_fila: set = set()
+_futuros: set = set()
+_locks_por_cpf: dict = {}
+_pendentes_lock = threading.Lock()
+
+
+def _gravacao_concluida(futuro) -> None:
+    with _pendentes_lock:
+        _futuros.discard(futuro)
+
+
+def _gravar_pendentes(cpf: str) -> None:
+    with _pendentes_lock:
+        lock_cpf = _locks_por_cpf.setdefault(cpf, threading.Lock())
+    with lock_cpf:
+        with _pendentes_lock:
+            pendentes = _appends_pendentes.pop(cpf, None)
+            _cpfs_na_fila.discard(cpf)
+        if not pendentes:
+            return
+        mensagens, historico, total, history_dir = pendentes
+        # O histórico só cresce: o recorte é exatamente o estado no último agendamento
+        completo = historico[:total] if historico is not None else None
+        try:
+            salvar_mensagens_append(cpf, mensagens, history_dir, completo)
         except Exception as e:
-            print(f"[ERRO] Erro ao salvar no Cosmos DB: {e}")
+            log.error("[ERRO] Erro ao salvar histórico: %s", e)
+            # Devolve o lote à frente do que chegou depois; a próxima gravação do CPF
+            # (ou aguardar_gravacoes) tenta de novo
+            with _pendentes_lock:
+                seguintes = _appends_pendentes.get(cpf)
+                if seguintes is None:
+                    _appends_pendentes[cpf] = pendentes
+                else:
+                    seguintes[0][:0] = mensagens
+
+
+def agendar_mensagens_append(cpf: str, novas_mensagens: list, history_dir: Path,
+                             historico: Optional[list] = None) -> None:
+    """Agenda salvar_mensagens_append fora do caminho da resposta, agrupando escritas pendentes
+    
+    `historico` é a lista completa (já com as novas mensagens) mantida pelo chamador; só é
+    lida na gravação se o banco falhar.
+    """
+    total = len(historico) if historico is not None else 0
+    with _pendentes_lock:
+        pendentes = _appends_pendentes.get(cpf)
+        if pendentes is not None:
+            pendentes[0].extend(novas_mensagens)
+            pendentes[1], pendentes[2] = historico, total
+        else:
+            _appends_pendentes[cpf] = [list(novas_mensagens), historico, total, history_dir]
+        if cpf in _cpfs_na_fila:
+            # Ainda há uma gravação na fila para este CPF; ela levará estas mensagens também
+            return
+        _cpfs_na_fila.add(cpf)
+        futuro = _gravador.submit(_gravar_pendentes, cpf)
+        _futuros.add(futuro)
+    futuro.add_done_callback(_gravacao_concluida)
+
+
+def aguardar_gravacoes() -> None:
+    """Bloqueia até que todas as gravações agendadas terminem
+    
+    Lotes que falharam em segundo plano são gravados de novo aqui, de forma síncrona. O
+    gravador continua aceitando novos agendamentos depois.
+    """
+    while True:
+        with _pendentes_lock:
+            futuros = set(_futuros)
+        if not futuros:
+            break
+        wait(futuros)
+    
+    with _pendentes_lock:
+        restantes = [cpf for cpf in _appends_pendentes if cpf not in _cpfs_na_fila]
+    for cpf in restantes:
+        _gravar_pendentes(cpf)
+
+
+def encerrar_gravacoes() -> None:
+    """Grava o que estiver pendente e encerra o gravador (no fim do processo)"""
+    aguardar_gravacoes()
+    _gravador.shutdown(wait=True)
+
+
+atexit.register(encerrar_gravacoes)
+
+
+@lru_cache(maxsize=8)
+def _carregar_usuarios_cache(arquivo: str, mtime_ns: int) -> Mapping:
+    """Lê e decodifica a base de usuários; a chave inclui o mtime para invalidar ao editar o arquivo
     
-    print("[LOG] Salvando em arquivo local..")
-    caminho = history_dir / f"{cpf}.json"
-    with open(caminho, "w", encoding="utf-8") as f:
-        json.dump(historico, f, indent=2, ensure_ascii=False)
+    A mesma instância é compartilhada por todas as sessões, então é devolvida somente
+    leitura: um chamador não consegue alterar o cache dos demais por engano.
+    """
+    with open(arquivo, "rb") as f:
+        return MappingProxyType(_json_loads(f.read()))
 
 
-def carregar_usuarios(arquivo: str = "users.json") -> dict:
-    """Carrega base de usuários do arquivo JSON"""
+def carregar_usuarios(arquivo: str = "users.json") -> Mapping:
+    """Carrega base de usuários do arquivo JSON (reaproveitada enquanto o arquivo não mudar)"""
     try:
-        with open(arquivo, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return _carregar_usuarios_cache(arquivo, os.stat(arquivo).st_mtime_ns)
     except FileNotFoundError:
-        print(f"[ERRO] Arquivo {arquivo} não encontrado.")
+        log.error("[ERRO] Arquivo %s não encontrado.", arquivo)
         return {}
     except json.JSONDecodeError:
-        print(f"[ERRO] Erro ao decodificar {arquivo}.")
+        log.error("[ERRO] Erro ao decodificar %s.", arquivo)
         return {}
 
 
-def validar_cpf(cpf: str, usuarios: dict) -> bool:
+def validar_cpf(cpf: str, usuarios: Mapping) -> bool:
     return cpf in usuarios
 
 
 def adicionar_cpf_ao_contexto(historico: list, cpf: str) -> None:
-    if not any(item.get("role") == "system" and "CPF do usuário" in item.get("content", "") 
-               for item in historico):
+    # A mensagem do CPF sempre ocupa a primeira posição (criada assim no main.py, no batch
+    # de boas-vindas e aqui), então basta olhar historico[0] em vez de varrer o histórico
+    primeira = historico[0] if historico else {}
+    if not (primeira.get("role") == "system" and primeira.get("content", "").startswith("O CPF do usuário")):
         historico.insert(0, {"role": "system", "content": f"O CPF do usuário para esta sessão é {cpf}."})
 
 
-def buscar_mensagens_por_agente(cpf: str, agente: str, history_dir: Path = None) -> list:
+@lru_cache(maxsize=256)
+def _indice_historico_local(cpf: str, history_dir: str, mtime_ns: int) -> HistoricoIndex:
+    return HistoricoIndex.de_lista(carregar_historico(cpf, Path(history_dir)))
+
+
+def analisar_historico(cpf: str, history_dir: Path = None) -> HistoricoIndex:
+    """Carrega o histórico uma vez e indexa por agente em uma única passada
+    
+    Quem precisa de mais de uma visão (agentes usados, contagem, mensagens de um agente)
+    deve chamar esta função e consultar o índice, em vez de pagar uma carga completa do
+    histórico por consulta. Sem o Cosmos DB, o índice do arquivo local fica em cache até
+    o mtime do arquivo mudar; por isso o índice devolvido deve ser tratado como somente leitura.
+    """
     if history_dir is None:
         history_dir = Path("chat_history")
     
-    historico = carregar_historico(cpf, history_dir)
-    mensagens_agente = []
-    
-    for mensagem in historico:
-        if (mensagem.get("role") == "assistant" and 
-            mensagem.get("agent") == agente):
-            mensagens_agente.append(mensagem)
+    if not (conexao_disponivel and verificar_conexao()):
+        # Mesma ordem de carregar_historico: .jsonl e, na falta dele, o formato antigo
+        for caminho in (history_dir / f"{cpf}.jsonl", history_dir / f"{cpf}.json"):
+            try:
+                mtime_ns = os.stat(caminho).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            return _indice_historico_local(cpf, str(history_dir), mtime_ns)
     
-    return mensagens_agente
+    return HistoricoIndex.de_lista(carregar_historico(cpf, history_dir))
+
+
+def buscar_mensagens_por_agente(cpf: str, agente: str, history_dir: Path = None) -> list:
+    return analisar_historico(cpf, history_dir).mensagens_do_agente(agente)
 
 
 def listar_agentes_usados(cpf: str, history_dir: Path = None) -> list:
-    if history_dir is None:
-        history_dir = Path("chat_history")
-    
-    historico = carregar_historico(cpf, history_dir)
-    agentes = set()
-    
-    for mensagem in historico:
-        if (mensagem.get("role") == "assistant" and 
-            "agent" in mensagem):
-            agentes.add(mensagem["agent"])
-    
-    return sorted(agentes)
+    return analisar_historico(cpf, history_dir).agentes()
 
 
 def estatisticas_agentes(cpf: str, history_dir: Path = None) -> dict:
-    if history_dir is None:
-        history_dir = Path("chat_history")
-    
-    historico = carregar_historico(cpf, history_dir)
-    estatisticas = {}
-    
-    for mensagem in historico:
-        if (mensagem.get("role") == "assistant" and 
-            "agent" in mensagem):
-            agente = mensagem["agent"]
-            if agente not in estatisticas:
-                estatisticas[agente] = 0
-            estatisticas[agente] += 1
-    
-    return estatisticas
+    return analisar_historico(cpf, history_dir).contagem_por_agente()
 
 
 def enviar_boas_vindas(nome: str, historico: list) -> None:
-    prompt_base = carregar_prompt()
+    """Entrada síncrona de enviar_boas_vindas_async, usada pelo main.py"""
+    executar_no_loop(enviar_boas_vindas_async(nome, historico))
+
+
+async def enviar_boas_vindas_async(nome: str, historico: list) -> None:
+    """Gera a mensagem de boas-vindas sem bloquear o event loop durante a chamada à OpenAI
+    
+    A resposta é transmitida: cada trecho é exibido assim que chega e o texto completo é
+    acumulado para o histórico.
+    """
     mensagem_trigger = f"PRIMEIRA_INTERACAO: {nome}"
+    partes = []
     
     try:
-        mensagens = [
-            {"role": "system", "content": prompt_base},
-            {"role": "system", "content": mensagem_trigger}
-        ]
+        mensagens = [*_mensagens_base(), {"role": "system", "content": mensagem_trigger}]
         
-        resposta = client.chat.completions.create(
-            model="gpt-4o",
+        resposta = await async_client.chat.completions.create(
+            model=MODELO_BOAS_VINDAS,
             messages=mensagens,
-            temperature=0.3
+            temperature=0.3,
+            stream=True
         )
         
-        mensagem_boas_vindas = resposta.choices[0].message.content.strip()
-        print(f"\nAssistente: {mensagem_boas_vindas}\n")
+        print("\nAssistente: ", end="", flush=True)
+        async for chunk in resposta:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not partes:
+                    delta = delta.lstrip()
+                partes.append(delta)
+                print(delta, end="", flush=True)
+        print("\n")
+        
+        mensagem_boas_vindas = "".join(partes).strip()
         
         historico.append({
             "role": "assistant",
@@ -164,7 +452,7 @@ def enviar_boas_vindas(nome: str, historico: list) -> None:
         })
         
     except Exception as e:
-        print(f"[ERRO] Erro ao gerar boas-vindas: {e}")
+        print(f"\n[ERRO] Erro ao gerar boas-vindas: {e}")
         mensagem_fallback = f"Olá {nome}, seja bem-vindo(a) ao atendimento Caixa! Como posso ajudá-lo hoje? 😊"
         print(f"\nAssistente: {mensagem_fallback}\n")
         
@@ -174,3 +462,74 @@ def enviar_boas_vindas(nome: str, historico: list) -> None:
             "agent": "assistant_inicial"
         })
 
+
+def enviar_boas_vindas_batch(usuarios: dict) -> str:
+    """
+    Enfileira boas-vindas de vários clientes na Batch API da OpenAI (metade do custo)
+    
+    Para uso fora do atendimento em tempo real (ex.: onboarding noturno); o resultado
+    fica pronto em até 24h e é recuperado com obter_boas_vindas_batch.
+    
+    Args:
+        usuarios: Mapeamento CPF -> nome
+        
+    Returns:
+        str: ID do batch criado
+    """
+    base = _mensagens_base()
+    linhas = [
+        _json_linha({
+            "custom_id": cpf,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": MODELO_BOAS_VINDAS,
+                "messages": [*base, {"role": "system", "content": f"PRIMEIRA_INTERACAO: {nome}"}],
+                "temperature": 0.3
+            }
+        })
+        for cpf, nome in usuarios.items()
+    ]
+    
+    arquivo = client.files.create(file=("boas_vindas.jsonl", b"".join(linhas)), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=arquivo.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    log.info("[LOG] Batch de boas-vindas criado: %s (%s clientes)", batch.id, len(linhas))
+    return batch.id
+
+
+def obter_boas_vindas_batch(batch_id: str, history_dir: Path) -> dict:
+    """
+    Recupera as boas-vindas de um batch concluído e grava no histórico de quem ainda não tem
+    
+    Returns:
+        dict: CPF -> mensagem de boas-vindas (vazio se o batch ainda não terminou)
+    """
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        log.info("[LOG] Batch %s ainda não concluído (status: %s)", batch_id, batch.status)
+        return {}
+    
+    mensagens = {}
+    for linha in client.files.content(batch.output_file_id).text.splitlines():
+        if not linha.strip():
+            continue
+        item = _json_loads(linha)
+        resposta = item.get("response") or {}
+        if resposta.get("status_code") != 200:
+            log.error("[ERRO] Boas-vindas do CPF %s falhou no batch", item.get('custom_id'))
+            continue
+        mensagens[item["custom_id"]] = resposta["body"]["choices"][0]["message"]["content"].strip()
+    
+    for cpf, mensagem in mensagens.items():
+        if carregar_historico(cpf, history_dir):
+            continue
+        salvar_historico(cpf, [
+            {"role": "system", "content": f"O CPF do usuário para esta sessão é {cpf}."},
+            {"role": "assistant", "content": mensagem, "agent": "assistant_inicial"}
+        ], history_dir)
+    
+    return mensagens
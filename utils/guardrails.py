@@ -1,20 +1,113 @@
 from typing import Optional, Tuple, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
+import hashlib
+import json
+import logging
 import os
+import re
 from dotenv import load_dotenv
 from openai import OpenAI
+from .cache_ttl import CacheTTL
 from .moderation import ModerationManager
 
+log = logging.getLogger("orchestrator")
+
+try:
+    # Parser em C/Rust, bem mais rápido que o json da biblioteca padrão (opcional)
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+
+_MENSAGEM_BLOQUEIO_COMIDA = (
+    "Desculpe, não posso ajudar com questões relacionadas a comida ou alimentação. "
+    "Estou aqui para auxiliar com serviços bancários, FGTS e empréstimos da Caixa. "
+    "Como posso ajudá-lo com nossos produtos financeiros? 😊"
+)
+
+# Respostas S/N do classificador de comida por (prompt, entrada): mensagens repetidas
+# dentro da janela de validade não pagam outra chamada ao modelo
+_decisoes_comida = CacheTTL(max_itens=512, ttl_segundos=600.0)
+_decisoes_combinadas = CacheTTL(max_itens=512, ttl_segundos=600.0)
+
+# O diretório dos prompts só precisa ser garantido uma vez por processo, não a cada
+# GuardRailsManager construído
+_diretorio_guardrails_pronto = False
+
+
+def _garantir_diretorio(caminho: Path) -> None:
+    global _diretorio_guardrails_pronto
+    if _diretorio_guardrails_pronto:
+        return
+    caminho.mkdir(exist_ok=True)
+    _diretorio_guardrails_pronto = True
+
+# Classificação binária de uma palavra: o modelo menor decide igual, com menos latência e custo
+MODELO_GUARDRAIL = os.getenv("GUARDRAIL_MODEL", "gpt-4o-mini")
+
+
+def _vies_sim_nao() -> Dict[str, int]:
+    """logit_bias que restringe a saída aos tokens "S" e "N" (vazio se o tiktoken não carregar)"""
+    try:
+        import tiktoken
+        try:
+            codificador = tiktoken.encoding_for_model(MODELO_GUARDRAIL)
+        except KeyError:
+            codificador = tiktoken.get_encoding("o200k_base")
+        return {str(token): 100 for letra in ("S", "N") for token in codificador.encode(letra)}
+    except Exception as e:
+        # Sem o pacote ou sem rede para baixar o vocabulário: o guardrail só perde o viés
+        log.warning("[AVISO] logit_bias do guardrail desativado: %s", e)
+        return {}
+
+
+_VIES_SIM_NAO = _vies_sim_nao()
+
+
+def _ler_prompt_guardrail(caminho: Path, debug: bool = False) -> Optional[str]:
+    """Conteúdo do prompt de um guardrail, ou None se o arquivo não existir"""
+    if not caminho.exists():
+        if debug:
+            log.warning("[AVISO] Arquivo %s não encontrado", caminho)
+        return None
+    with open(caminho, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+_SEM_DETALHES = MappingProxyType({})
+
 
 class GuardrailResult:
-    def __init__(self, passed: bool, message: str = "", details: Optional[Dict] = None):
+    __slots__ = ("passed", "message", "details", "tripwire_triggered", "erro")
+    
+    def __init__(self, passed: bool, message: str = "", details: Optional[Dict] = None, erro: bool = False):
         self.passed = passed
         self.message = message
-        self.details = details or {}
+        self.details = details or _SEM_DETALHES
         self.tripwire_triggered = not passed
+        # Aprovação por fail-open (a verificação não chegou a ser feita)
+        self.erro = erro
+
+
+@lru_cache(maxsize=None)
+def _aprovado(message: str) -> GuardrailResult:
+    """Resultado de aprovação compartilhado por mensagem fixa (os chamadores só leem os campos)"""
+    return GuardrailResult(passed=True, message=message)
+
+
+@lru_cache(maxsize=None)
+def _falha_aberta(message: str) -> GuardrailResult:
+    """Aprovação por erro do guardrail (fail-open), marcada para não ser memorizada"""
+    return GuardrailResult(passed=True, message=message, erro=True)
 
 
 class InputGuardrail: 
+    # Guardrails locais (sem chamada de rede) rodam antes e em sequência; os demais em paralelo
+    local = False
+    
     def __init__(self, name: str, client: OpenAI, debug: bool = False):
         self.name = name
         self.client = client
@@ -38,9 +131,10 @@ class OutputGuardrail:
 
 class ModerationInputGuardrail(InputGuardrail):
     
-    def __init__(self, client: OpenAI, debug: bool = False):
+    def __init__(self, client: OpenAI, debug: bool = False,
+                 moderation_manager: Optional[ModerationManager] = None):
         super().__init__("openai_moderation", client, debug)
-        self.moderation_manager = ModerationManager(client, debug)
+        self.moderation_manager = moderation_manager or ModerationManager(client, debug)
     
     def validate(self, user_input: str) -> GuardrailResult:
         try:
@@ -52,129 +146,344 @@ class ModerationInputGuardrail(InputGuardrail):
                     message=message,
                     details={"moderation_details": details}
                 )
+            if details and details.get("erro"):
+                return _falha_aberta("Erro na moderação - permitindo")
             
-            return GuardrailResult(passed=True, message="Conteúdo aprovado pela moderação")
+            return _aprovado("Conteúdo aprovado pela moderação")
             
         except Exception as e:
             if self.debug:
-                print(f"[ERRO] Erro no guardrail de moderação: {e}")
+                log.error("[ERRO] Erro no guardrail de moderação: %s", e)
             # Em caso de erro, permitir (fail-open)
-            return GuardrailResult(passed=True, message="Erro na moderação - permitindo")
+            return _falha_aberta("Erro na moderação - permitindo")
 
 
 class FoodContentInputGuardrail(InputGuardrail):
     """Guardrail para detectar conteúdo sobre comida"""
     
+    # Mensagens curtas com termo bancário explícito ("quero um empréstimo de 5000 reais")
+    # dispensam o classificador apenas se TODAS as palavras estiverem na lista fechada
+    # abaixo. Uma lista de palavras de comida nunca é completa ("empréstimo para comprar
+    # cerveja"); qualquer palavra fora da lista manda a mensagem para o classificador
+    _TERMOS_BANCARIOS = frozenset({
+        "empréstimo", "emprestimo", "empréstimos", "emprestimos", "fgts", "crédito",
+        "credito", "parcela", "parcelas", "extrato", "extratos", "saldo", "saque",
+        "antecipação", "antecipacao", "consignado",
+    })
+    _PALAVRAS_PERMITIDAS = _TERMOS_BANCARIOS | frozenset({
+        "a", "o", "as", "os", "um", "uma", "de", "do", "da", "dos", "das", "no", "na", "em",
+        "e", "é", "eu", "me", "meu", "minha", "meus", "minhas", "para", "pra", "por", "com",
+        "qual", "quais", "quanto", "quantas", "quantos", "como", "quero", "queria",
+        "gostaria", "preciso", "posso", "pode", "ver", "consultar", "simular", "simulação",
+        "simulacao", "fazer", "pedir", "solicitar", "contratar", "sacar", "antecipar",
+        "valor", "taxa", "juros", "reais", "r", "mil", "vezes", "mês", "mes", "meses",
+        "sim", "não", "nao", "ok", "obrigado", "obrigada", "oi", "olá", "ola",
+    })
+    _RE_PALAVRA = re.compile(r"[^\W\d_]+|\d+")
+    MAX_CARACTERES_ATALHO = 120
+    
     def __init__(self, client: OpenAI, guardrails_dir: Path, debug: bool = False):
         super().__init__("food_content", client, debug)
         self.guardrails_dir = guardrails_dir
+        self.recarregar_prompt()
+    
+    def recarregar_prompt(self) -> None:
+        """Relê FoodGuardRails.txt (lido uma vez na criação, não a cada mensagem)"""
+        self._prompt = _ler_prompt_guardrail(self.guardrails_dir / "FoodGuardRails.txt", self.debug)
+        # Hash parcial do prompt; cada mensagem só acrescenta a entrada do usuário
+        self._hash_prompt = hashlib.sha1(f"{self._prompt}\x00".encode("utf-8"))
+    
+    def _apenas_termos_bancarios(self, user_input: str) -> bool:
+        if len(user_input) > self.MAX_CARACTERES_ATALHO:
+            return False
+        palavras = self._RE_PALAVRA.findall(user_input.lower())
+        return (any(p in self._TERMOS_BANCARIOS for p in palavras)
+                and all(p.isdigit() or p in self._PALAVRAS_PERMITIDAS for p in palavras))
     
     def validate(self, user_input: str) -> GuardrailResult:
         """Valida se entrada contém conteúdo sobre comida"""
+        if self._prompt is None:
+            return _aprovado("Guardrail não configurado")
+        
+        if self._apenas_termos_bancarios(user_input):
+            return _aprovado("Intenção bancária explícita - classificador dispensado")
+        
         try:
-            prompt_path = self.guardrails_dir / "FoodGuardRails.txt"
-            if not prompt_path.exists():
-                if self.debug:
-                    print(f"[AVISO] Arquivo {prompt_path} não encontrado")
-                return GuardrailResult(passed=True, message="Guardrail não configurado")
-            
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                prompt_guardrail = f.read().strip()
-            
-            mensagens = [
-                {"role": "system", "content": prompt_guardrail},
-                {"role": "user", "content": user_input}
-            ]
-            
-            resposta = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=mensagens,
-                max_tokens=1,
-                temperature=0.0
-            )
-            
-            resultado = resposta.choices[0].message.content.strip().upper()
+            prompt_guardrail = self._prompt
+            hash_entrada = self._hash_prompt.copy()
+            hash_entrada.update(user_input.encode("utf-8"))
+            chave = hash_entrada.hexdigest()
+            resultado = _decisoes_comida.obter(chave)
+            if resultado is None:
+                mensagens = [
+                    {"role": "system", "content": prompt_guardrail},
+                    {"role": "user", "content": user_input}
+                ]
+                
+                resposta = self.client.chat.completions.create(
+                    model=MODELO_GUARDRAIL,
+                    messages=mensagens,
+                    max_tokens=1,
+                    temperature=0.0,
+                    **({"logit_bias": _VIES_SIM_NAO} if _VIES_SIM_NAO else {})
+                )
+                
+                resultado = resposta.choices[0].message.content.strip().upper()
+                _decisoes_comida.armazenar(chave, resultado)
             
             if self.debug:
-                print(f"[DEBUG] Food Guardrail - Result: '{resultado}'")
+                log.debug("[DEBUG] Food Guardrail - Result: '%s'", resultado)
             
             if resultado == "S":
                 return GuardrailResult(
                     passed=False,
-                    message=(
-                        "Desculpe, não posso ajudar com questões relacionadas a comida ou alimentação. "
-                        "Estou aqui para auxiliar com serviços bancários, FGTS e empréstimos da Caixa. "
-                        "Como posso ajudá-lo com nossos produtos financeiros? 😊"
-                    ),
+                    message=_MENSAGEM_BLOQUEIO_COMIDA,
                     details={"detected_food_content": True}
                 )
             
-            return GuardrailResult(passed=True, message="Não detectado conteúdo sobre comida")
+            return _aprovado("Não detectado conteúdo sobre comida")
             
         except Exception as e:
             if self.debug:
-                print(f"[ERRO] Erro no guardrail de comida: {e}")
-            return GuardrailResult(passed=True, message="Erro no guardrail - permitindo")
+                log.error("[ERRO] Erro no guardrail de comida: %s", e)
+            return _falha_aberta("Erro no guardrail - permitindo")
+
+
+class CombinedContentInputGuardrail(InputGuardrail):
+    """Comida e moderação em uma única chamada ao gpt-4o-mini (JSON estruturado)
+    
+    Substitui a dupla moderação + classificador de comida quando ativado no
+    GuardRailsManager. O endpoint de moderação só é consultado, para confirmar, quando
+    o modelo marca a mensagem como suspeita ou quando a chamada combinada falha.
+    """
+    
+    def __init__(self, client: OpenAI, guardrails_dir: Path, debug: bool = False,
+                 moderation_manager: Optional[ModerationManager] = None):
+        super().__init__("combined_content", client, debug)
+        self.guardrails_dir = guardrails_dir
+        self.moderation_manager = moderation_manager or ModerationManager(client, debug)
+        self.recarregar_prompt()
+    
+    def recarregar_prompt(self) -> None:
+        """Relê CombinedGuardRails.txt (lido uma vez na criação, não a cada mensagem)"""
+        self._prompt = _ler_prompt_guardrail(self.guardrails_dir / "CombinedGuardRails.txt", self.debug)
+        self._hash_prompt = hashlib.sha1(f"{self._prompt}\x00".encode("utf-8"))
+    
+    def validate(self, user_input: str) -> GuardrailResult:
+        falhou = False
+        try:
+            prompt_guardrail = self._prompt
+            if prompt_guardrail is None:
+                raise FileNotFoundError(self.guardrails_dir / "CombinedGuardRails.txt")
+            
+            hash_entrada = self._hash_prompt.copy()
+            hash_entrada.update(user_input.encode("utf-8"))
+            chave = hash_entrada.hexdigest()
+            decisao = _decisoes_combinadas.obter(chave)
+            if decisao is None:
+                resposta = self.client.chat.completions.create(
+                    model=MODELO_GUARDRAIL,
+                    messages=[
+                        {"role": "system", "content": prompt_guardrail},
+                        {"role": "user", "content": user_input}
+                    ],
+                    response_format={"type": "json_object"},
+                    max_tokens=40,
+                    temperature=0.0
+                )
+                decisao = _json_loads(resposta.choices[0].message.content)
+                _decisoes_combinadas.armazenar(chave, decisao)
+            
+            if self.debug:
+                log.debug("[DEBUG] Combined Guardrail - Result: %s", decisao)
+        except Exception as e:
+            if self.debug:
+                log.error("[ERRO] Erro no guardrail combinado: %s", e)
+            falhou = True
+            decisao = {"moderacao": "SUSPEITO"}
+        
+        if str(decisao.get("comida", "N")).strip().upper() == "S":
+            return GuardrailResult(
+                passed=False,
+                message=_MENSAGEM_BLOQUEIO_COMIDA,
+                details={"detected_food_content": True}
+            )
+        
+        if str(decisao.get("moderacao", "OK")).strip().upper() != "OK":
+            blocked, message, details = self.moderation_manager.moderar_conteudo(user_input)
+            if blocked:
+                return GuardrailResult(
+                    passed=False,
+                    message=message,
+                    details={"moderation_details": details}
+                )
+            falhou = falhou or bool(details and details.get("erro"))
+        
+        if falhou:
+            return _falha_aberta("Erro no guardrail combinado - permitindo")
+        return _aprovado("Conteúdo aprovado pelo guardrail combinado")
+
+
+class FoodBlocklistInputGuardrail(InputGuardrail):
+    """Pré-filtro local de termos óbvios de comida, avaliado antes das chamadas à OpenAI
+    
+    Os termos de guardrails/FoodBlocklist.txt (um por linha) são compilados em uma única
+    regex, então uma mensagem como "empréstimo para abrir uma pizzaria" é bloqueada em
+    microssegundos sem passar pela moderação nem pelo guardrail de comida via LLM.
+    """
+    local = True
+    
+    def __init__(self, client: OpenAI, guardrails_dir: Path, debug: bool = False):
+        super().__init__("food_blocklist", client, debug)
+        self.padrao = self._compilar_blocklist(guardrails_dir / "FoodBlocklist.txt")
+    
+    def _compilar_blocklist(self, caminho: Path) -> Optional[re.Pattern]:
+        conteudo = _ler_prompt_guardrail(caminho, self.debug)
+        if conteudo is None:
+            return None
+        
+        termos = {linha.strip().lower() for linha in conteudo.splitlines() if linha.strip()}
+        if not termos:
+            return None
+        
+        # Termos mais longos primeiro para a alternação preferir o casamento completo
+        alternativas = "|".join(re.escape(t) for t in sorted(termos, key=len, reverse=True))
+        return re.compile(rf"\b(?:{alternativas})s?\b")
+    
+    def validate(self, user_input: str) -> GuardrailResult:
+        if self.padrao is None:
+            return _aprovado("Blocklist não configurada")
+        
+        encontrado = self.padrao.search(user_input.lower())
+        if encontrado:
+            if self.debug:
+                log.debug("[DEBUG] Food Blocklist - Termo: '%s'", encontrado.group(0))
+            return GuardrailResult(
+                passed=False,
+                message=_MENSAGEM_BLOQUEIO_COMIDA,
+                details={"detected_food_content": True, "termo": encontrado.group(0)}
+            )
+        
+        return _aprovado("Nenhum termo da blocklist encontrado")
 
 
 class GuardRailsManager: 
-    def __init__(self, client: OpenAI = None, debug: bool = False):
+    guardrails_dir = Path("guardrails")
+    
+    def __init__(self, client: OpenAI = None, debug: bool = False, combinado: Optional[bool] = None):
         if client is None:
             load_dotenv()
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 raise ValueError("OPENAI_API_KEY não encontrada nas variáveis de ambiente")
-            client = OpenAI(api_key=api_key)
+            # Sem client explícito, usa o do processo em vez de abrir outro pool de conexões
+            from .openai_client import client
             
         self.client = client
         self.debug = debug
-        self.guardrails_dir = Path("guardrails")
-        self.guardrails_dir.mkdir(exist_ok=True)
+        _garantir_diretorio(self.guardrails_dir)
+        
+        # Inicializar guardrails de entrada (a blocklist local vem primeiro e interrompe
+        # a cadeia antes das chamadas à OpenAI quando encontra um termo). Com o modo
+        # combinado (GUARDRAILS_COMBINADOS=1), moderação e comida viram uma única chamada
+        if combinado is None:
+            combinado = os.getenv("GUARDRAILS_COMBINADOS", "0") == "1"
         
-        # Inicializar guardrails de entrada
-        self.input_guardrails = [
-            ModerationInputGuardrail(client, debug),
-            FoodContentInputGuardrail(client, self.guardrails_dir, debug)
-        ]
+        # Uma única instância (e um único cache de moderação) para todos os guardrails
+        self.moderation_manager = ModerationManager(client, debug)
+        
+        if combinado:
+            self.input_guardrails = [
+                FoodBlocklistInputGuardrail(client, self.guardrails_dir, debug),
+                CombinedContentInputGuardrail(client, self.guardrails_dir, debug, self.moderation_manager)
+            ]
+        else:
+            self.input_guardrails = [
+                FoodBlocklistInputGuardrail(client, self.guardrails_dir, debug),
+                ModerationInputGuardrail(client, debug, self.moderation_manager),
+                FoodContentInputGuardrail(client, self.guardrails_dir, debug)
+            ]
         
         # Guardrails de saída (expandir conforme necessário)
         self.output_guardrails = []
+        
+        # Os guardrails remotos são independentes e fail-open: cada um vai para uma thread
+        # e a validação custa a chamada mais lenta, não a soma das chamadas
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, sum(not g.local for g in self.input_guardrails)),
+            thread_name_prefix="guardrails"
+        )
     
     def aplicar_guardrails_entrada(self, user_input: str) -> Tuple[bool, str, Dict[str, Any]]:
         """
         Aplica todos os guardrails de entrada
         
+        Os locais rodam primeiro, em ordem; os remotos rodam em paralelo e o primeiro que
+        bloquear encerra a validação sem esperar pelos outros.
+        
         Returns:
             Tuple: (bloqueado, mensagem_erro, detalhes)
         """
         all_details = {}
         
         for guardrail in self.input_guardrails:
+            if not guardrail.local:
+                continue
             try:
                 resultado = guardrail.validate(user_input)
-                
-                all_details[guardrail.name] = {
-                    "passed": resultado.passed,
-                    "message": resultado.message,
-                    "details": resultado.details
-                }
-                
-                if resultado.tripwire_triggered:
-                    if self.debug:
-                        print(f"[GUARDRAIL] {guardrail.name} bloqueou entrada")
-                    return True, resultado.message, all_details
-                
             except Exception as e:
-                if self.debug:
-                    print(f"[ERRO] Erro ao executar guardrail {guardrail.name}: {e}")
-                all_details[guardrail.name] = {
-                    "passed": True, 
-                    "message": f"Erro no guardrail: {e}",
-                    "details": {}
-                }
+                self._registrar_erro_entrada(guardrail, e, all_details)
+                continue
+            if self._registrar_resultado_entrada(guardrail, resultado, all_details):
+                return True, resultado.message, all_details
+        
+        futuros = {
+            self._executor.submit(guardrail.validate, user_input): guardrail
+            for guardrail in self.input_guardrails if not guardrail.local
+        }
+        try:
+            for futuro in as_completed(futuros):
+                guardrail = futuros[futuro]
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    self._registrar_erro_entrada(guardrail, e, all_details)
+                    continue
+                if self._registrar_resultado_entrada(guardrail, resultado, all_details):
+                    return True, resultado.message, all_details
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
         
         return False, "", all_details
     
+    def _registrar_resultado_entrada(self, guardrail: InputGuardrail, resultado: GuardrailResult,
+                                     all_details: Dict[str, Any]) -> bool:
+        """Anota o resultado nos detalhes e indica se o guardrail bloqueou a entrada"""
+        all_details[guardrail.name] = {
+            "passed": resultado.passed,
+            "message": resultado.message,
+            "details": resultado.details,
+            "erro": resultado.erro
+        }
+        
+        if resultado.tripwire_triggered:
+            if self.debug:
+                log.info("[GUARDRAIL] %s bloqueou entrada", guardrail.name)
+            return True
+        return False
+    
+    def _registrar_erro_entrada(self, guardrail: InputGuardrail, e: Exception,
+                                all_details: Dict[str, Any]) -> None:
+        if self.debug:
+            log.error("[ERRO] Erro ao executar guardrail %s: %s", guardrail.name, e)
+        all_details[guardrail.name] = {
+            "passed": True, 
+            "message": f"Erro no guardrail: {e}",
+            "details": {},
+            "erro": True
+        }
+    
     def aplicar_guardrails_saida(self, assistant_output: str, 
                                 context: Optional[Dict] = None) -> Tuple[bool, str, Dict[str, Any]]:
         """
@@ -197,12 +506,12 @@ class GuardRailsManager:
                 
                 if resultado.tripwire_triggered:
                     if self.debug:
-                        print(f"[GUARDRAIL] {guardrail.name} bloqueou saída")
+                        log.info("[GUARDRAIL] %s bloqueou saída", guardrail.name)
                     return True, resultado.message, all_details
                 
             except Exception as e:
                 if self.debug:
-                    print(f"[ERRO] Erro ao executar guardrail {guardrail.name}: {e}")
+                    log.error("[ERRO] Erro ao executar guardrail %s: %s", guardrail.name, e)
                 all_details[guardrail.name] = {
                     "passed": True, 
                     "message": f"Erro no guardrail: {e}",
@@ -217,14 +526,21 @@ class GuardRailsManager:
         bloqueado, mensagem, _ = self.aplicar_guardrails_entrada(mensagem_usuario)
         return bloqueado, mensagem
     
+    def recarregar_prompts(self) -> None:
+        """Relê os prompts dos guardrails após editar os arquivos em guardrails/"""
+        for guardrail in self.input_guardrails:
+            recarregar = getattr(guardrail, "recarregar_prompt", None)
+            if recarregar is not None:
+                recarregar()
+    
     def adicionar_guardrail_entrada(self, guardrail: InputGuardrail) -> None:
         """Adiciona um novo guardrail de entrada"""
         self.input_guardrails.append(guardrail)
         if self.debug:
-            print(f"[CONFIG] Guardrail de entrada adicionado: {guardrail.name}")
+            log.info("[CONFIG] Guardrail de entrada adicionado: %s", guardrail.name)
     
     def adicionar_guardrail_saida(self, guardrail: OutputGuardrail) -> None:
         """Adiciona um novo guardrail de saída"""
         self.output_guardrails.append(guardrail)
         if self.debug:
-            print(f"[CONFIG] Guardrail de saída adicionado: {guardrail.name}")
+            log.info("[CONFIG] Guardrail de saída adicionado: %s", guardrail.name)
@@ -0,0 +1,93 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass(slots=True)
+class HistoricoIndex:
+    """
+    Histórico de mensagens com índices por agente mantidos a cada append
+
+    Apenas `mensagens` é persistido (arquivo/Cosmos DB); os índices são reconstruídos
+    ao carregar com de_lista e atualizados em O(1) por mensagem nova, então consultas
+    por agente custam O(k) nas mensagens do agente em vez de O(N) no histórico todo.
+    """
+    mensagens: List[Dict] = field(default_factory=list)
+    indices_por_agente: Dict[str, List[int]] = field(default_factory=dict)
+    indices_usuario: List[int] = field(default_factory=list)
+    indices_sistema: List[int] = field(default_factory=list)
+
+    @classmethod
+    def de_lista(cls, mensagens: Iterable[Dict]) -> "HistoricoIndex":
+        indice = cls()
+        indice.extend(mensagens)
+        return indice
+
+    def append(self, mensagem: Dict) -> None:
+        posicao = len(self.mensagens)
+        self.mensagens.append(mensagem)
+
+        role = mensagem.get("role")
+        if role == "user":
+            self.indices_usuario.append(posicao)
+        elif role == "assistant" and "agent" in mensagem:
+            self.indices_por_agente.setdefault(mensagem["agent"], []).append(posicao)
+        elif role == "system":
+            self.indices_sistema.append(posicao)
+
+    def extend(self, mensagens: Iterable[Dict]) -> None:
+        # Mesma lógica de append; é o laço da carga do histórico inteiro, então listas e
+        # métodos ficam em variáveis locais em vez de uma chamada de método por mensagem
+        lista = self.mensagens
+        adicionar = lista.append
+        adicionar_usuario = self.indices_usuario.append
+        adicionar_sistema = self.indices_sistema.append
+        por_agente = self.indices_por_agente
+        
+        posicao = len(lista)
+        for mensagem in mensagens:
+            adicionar(mensagem)
+            role = mensagem.get("role")
+            if role == "user":
+                adicionar_usuario(posicao)
+            elif role == "assistant" and "agent" in mensagem:
+                indices = por_agente.get(mensagem["agent"])
+                if indices is None:
+                    por_agente[mensagem["agent"]] = [posicao]
+                else:
+                    indices.append(posicao)
+            elif role == "system":
+                adicionar_sistema(posicao)
+            posicao += 1
+
+    def mensagens_do_agente(self, agente: str, limite: Optional[int] = None) -> List[Dict]:
+        """Respostas do agente em ordem cronológica (apenas as últimas `limite`, se informado)"""
+        indices = self.indices_por_agente.get(agente, [])
+        if limite is not None:
+            indices = indices[-limite:]
+        return [self.mensagens[i] for i in indices]
+
+    def interacoes_do_agente(self, agente: str, limite: Optional[int] = None) -> List[Tuple[Optional[Dict], Dict]]:
+        """Pares (pergunta, resposta); pergunta é a mensagem anterior quando é do usuário, senão None"""
+        indices = self.indices_por_agente.get(agente, [])
+        if limite is not None:
+            indices = indices[-limite:]
+
+        mensagens = self.mensagens
+        return [
+            (mensagens[i - 1] if i > 0 and mensagens[i - 1].get("role") == "user" else None, mensagens[i])
+            for i in indices
+        ]
+
+    def mensagens_sistema(self, ate: Optional[int] = None) -> List[Dict]:
+        """Mensagens de sistema em ordem (apenas as de posição < `ate`, se informado)"""
+        indices = self.indices_sistema
+        if ate is not None:
+            indices = indices[:bisect_left(indices, ate)]
+        return [self.mensagens[i] for i in indices]
+
+    def agentes(self) -> List[str]:
+        return sorted(self.indices_por_agente)
+
+    def contagem_por_agente(self) -> Dict[str, int]:
+        return {agente: len(indices) for agente, indices in self.indices_por_agente.items()}
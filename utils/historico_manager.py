@@ -1,31 +1,25 @@
-from typing import Dict, List, Optional
+from typing import Dict, List
 from pathlib import Path
-from utils.file_utils import carregar_historico
+from utils.file_utils import analisar_historico
+from utils.historico_index import HistoricoIndex
 
 
 class HistoricoManager:
     """Gerenciador de histórico com limitação por agente"""
     
-    def __init__(self, limite_mensagens_por_agente: int = 5):
+    def __init__(self, limite_mensagens_por_agente: int = 5, history_dir: Path = None):
         self.limite_mensagens_por_agente = limite_mensagens_por_agente
+        # Diretório padrão criado uma vez; os métodos ainda aceitam outro por chamada
+        self.history_dir = history_dir or Path("chat_history")
     
     def obter_historico_limitado_por_agente(self, cpf: str, agente: str, 
                                           history_dir: Path = None) -> List[Dict]:
-        if history_dir is None:
-            history_dir = Path("chat_history")
+        history_dir = history_dir or self.history_dir
         
-        historico_completo = carregar_historico(cpf, history_dir)
+        indice = analisar_historico(cpf, history_dir)
         
-        # Filtrar mensagens do agente específico (apenas assistant)
-        mensagens_agente = []
-        
-        for mensagem in historico_completo:
-            if (mensagem.get("role") == "assistant" and 
-                mensagem.get("agent") == agente):
-                mensagens_agente.append(mensagem)
-        
-        # Retornar apenas as últimas N mensagens
-        return mensagens_agente[-self.limite_mensagens_por_agente:]
+        # Últimas N mensagens do agente específico (apenas assistant)
+        return indice.mensagens_do_agente(agente, self.limite_mensagens_por_agente)
     
     def obter_contexto_relevante_para_agente(self, cpf: str, agente: str, 
                                            pergunta_atual: str,
@@ -36,70 +30,31 @@ class HistoricoManager:
         - Últimas N mensagens do agente específico
         - Pergunta atual do usuário
         """
-        if history_dir is None:
-            history_dir = Path("chat_history")
-        
-        historico_completo = carregar_historico(cpf, history_dir)
-        contexto = []
+        history_dir = history_dir or self.history_dir
         
-        contexto.extend(self._extrair_mensagens_system(historico_completo))
+        indice = analisar_historico(cpf, history_dir)
         
-        contexto.extend(self._obter_mensagens_agente_com_contexto(
-            cpf, agente, historico_completo, history_dir
-        ))
-        
-        contexto.append({"role": "user", "content": pergunta_atual})
-        
-        return contexto
+        return [
+            *indice.mensagens_sistema(),
+            *self._obter_mensagens_agente_com_contexto(agente, indice),
+            {"role": "user", "content": pergunta_atual}
+        ]
     
-    def _extrair_mensagens_system(self, historico: List[Dict]) -> List[Dict]:
-        return [msg for msg in historico if msg.get("role") == "system"]
-    
-    def _obter_mensagens_agente_com_contexto(self, cpf: str, agente: str, 
-                                           historico_completo: List[Dict],
-                                           history_dir: Path) -> List[Dict]:
-        mensagens_agente = self.obter_historico_limitado_por_agente(
-            cpf, agente, history_dir
-        )
-        
-        contexto = []
-        for msg_agente in mensagens_agente:
-            pergunta_anterior = self._encontrar_pergunta_anterior(
-                msg_agente, agente, historico_completo
-            )
-            if pergunta_anterior:
-                contexto.extend([pergunta_anterior, msg_agente])
-        
-        return contexto
-    
-    def _encontrar_pergunta_anterior(self, msg_agente: Dict, agente: str, 
-                                   historico_completo: List[Dict]) -> Optional[Dict]:
-        for i, msg in enumerate(historico_completo):
-            if (self._mensagem_corresponde(msg, msg_agente, agente) and 
-                i > 0 and 
-                historico_completo[i - 1].get("role") == "user"):
-                return historico_completo[i - 1]
-        return None
-    
-    def _mensagem_corresponde(self, msg: Dict, msg_agente: Dict, agente: str) -> bool:
-        return (msg.get("content") == msg_agente.get("content") and 
-                msg.get("role") == "assistant" and 
-                msg.get("agent") == agente)
+    def _obter_mensagens_agente_com_contexto(self, agente: str, indice: HistoricoIndex) -> List[Dict]:
+        return [
+            msg
+            for pergunta, msg_agente in indice.interacoes_do_agente(agente, self.limite_mensagens_por_agente)
+            if pergunta is not None
+            for msg in (pergunta, msg_agente)
+        ]
     
     def obter_estatisticas_agente(self, cpf: str, agente: str, 
                                 history_dir: Path = None) -> Dict:
-        if history_dir is None:
-            history_dir = Path("chat_history")
-        
-        mensagens_agente = self.obter_historico_limitado_por_agente(
-            cpf, agente, history_dir
-        )
+        history_dir = history_dir or self.history_dir
         
-        historico_completo = carregar_historico(cpf, history_dir)
-        total_mensagens_agente = sum(
-            1 for msg in historico_completo 
-            if msg.get("role") == "assistant" and msg.get("agent") == agente
-        )
+        indice = analisar_historico(cpf, history_dir)
+        mensagens_agente = indice.mensagens_do_agente(agente, self.limite_mensagens_por_agente)
+        total_mensagens_agente = len(indice.indices_por_agente.get(agente, ()))
         
         return {
             "agente": agente,
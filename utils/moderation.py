@@ -1,79 +1,193 @@
-from typing import Dict, Tuple, Optional
-from openai import OpenAI
+from typing import Dict, List, Tuple, Optional
+from types import MappingProxyType
+import asyncio
+import hashlib
+import logging
+from openai import AsyncOpenAI, OpenAI
+from .cache_ttl import CacheTTL
+
+log = logging.getLogger("orchestrator")
+
+# Resultado fail-open quando a API falha: aprova, mas os detalhes marcam o erro para que
+# quem guarda decisões (ex.: cache dos guardrails) não memorize essa aprovação
+_FALHA_MODERACAO = (False, "", MappingProxyType({"erro": True}))
 
 class ModerationManager:  
-    def __init__(self, client: OpenAI, debug: bool = False):
+    # Tabelas fixas da mensagem de bloqueio, montadas uma vez na definição da classe.
+    # _CATEGORIAS segue a ordem dos campos de openai.types.moderation.Categories
+    _CATEGORIAS = (
+        "harassment", "harassment_threatening", "hate", "hate_threatening", "illicit",
+        "illicit_violent", "self_harm", "self_harm_instructions", "self_harm_intent",
+        "sexual", "sexual_minors", "violence", "violence_graphic"
+    )
+    _CATEGORIAS_GRAVES = ("violence", "harassment_threatening", "hate_threatening", "sexual_minors")
+    # Ordem de escolha da descrição: as graves primeiro, depois as demais na ordem de _CATEGORIAS
+    _PRIORIDADE = _CATEGORIAS_GRAVES + (
+        "harassment", "hate", "illicit", "illicit_violent", "self_harm", "self_harm_instructions",
+        "self_harm_intent", "sexual", "violence_graphic"
+    )
+    _DESCRICOES = {
+        "violence": "conteúdo violento",
+        "harassment": "assédio ou intimidação", 
+        "harassment_threatening": "ameaças",
+        "hate": "discurso de ódio",
+        "sexual": "conteúdo sexual inapropriado",
+        "illicit": "atividades ilegais",
+        "illicit_violent": "atividades ilegais violentas", 
+        "self_harm": "conteúdo relacionado a autolesão"
+    }
+    _DESCRICAO_PADRAO = "conteúdo inapropriado"
+    _MSG_BLOQUEIO = """🚫 **Conteúdo Bloqueado**
+
+Sua mensagem foi bloqueada por conter {descricao}.
+
+Este é um sistema de atendimento bancário profissional. Por favor, mantenha suas perguntas relacionadas aos serviços da Caixa Econômica Federal.
+
+Como posso ajudá-lo com questões sobre empréstimos, FGTS ou outros serviços bancários?"""
+    
+    # Textos vazios ou com menos caracteres úteis que isso não têm o que moderar
+    MIN_CARACTERES_MODERACAO = 3
+    
+    # Textos longos vão para a API em partes deste tamanho, todas na mesma requisição
+    # (input aceita uma lista): o texto inteiro é moderado, sem uma única entrada enorme.
+    # Partes vizinhas se sobrepõem para que nenhum trecho fique cortado ao meio na emenda
+    MAX_CARACTERES_MODERACAO = 4000
+    SOBREPOSICAO_MODERACAO = 200
+    
+    # Limite de chamadas simultâneas em moderar_varios_async (respeita o rate limit da API)
+    MAX_MODERACOES_CONCORRENTES = 16
+    
+    def __init__(self, client: OpenAI, debug: bool = False, async_client: Optional[AsyncOpenAI] = None):
         self.client = client
         self.debug = debug
+        self.async_client = async_client
+        # Resultados recentes por texto; falhas da API não entram (são fail-open)
+        self._cache = CacheTTL(max_itens=512, ttl_segundos=600.0)
     
     def moderar_conteudo(self, texto: str) -> Tuple[bool, str, Optional[Dict]]:
+        if not texto or len(texto.strip()) < self.MIN_CARACTERES_MODERACAO:
+            return False, "", None
+        chave = self._chave_cache(texto)
+        
+        em_cache = self._cache.obter(chave)
+        if em_cache is not None:
+            return em_cache
+        
+        resultado = self._moderar(texto)
+        if resultado is not None:
+            self._cache.armazenar(chave, resultado)
+            return resultado
+        return _FALHA_MODERACAO
+    
+    async def moderar_varios_async(self, textos: List[str]) -> List[Tuple[bool, str, Optional[Dict]]]:
+        """
+        Modera vários textos em paralelo, com o mesmo cache e o mesmo fail-open de moderar_conteudo
+        
+        Para cargas em lote: as chamadas à API são sobrepostas (até MAX_MODERACOES_CONCORRENTES
+        ao mesmo tempo) e o tempo total fica próximo ao da chamada mais lenta. Os resultados
+        voltam na ordem dos textos.
+        """
+        if self.async_client is None:
+            from .openai_client import async_client
+            self.async_client = async_client
+        
+        limite = asyncio.Semaphore(self.MAX_MODERACOES_CONCORRENTES)
+        
+        async def moderar(texto: str) -> Tuple[bool, str, Optional[Dict]]:
+            if not texto or len(texto.strip()) < self.MIN_CARACTERES_MODERACAO:
+                return False, "", None
+            chave = self._chave_cache(texto)
+            
+            em_cache = self._cache.obter(chave)
+            if em_cache is not None:
+                return em_cache
+            
+            async with limite:
+                resultado = await self._moderar_async(texto)
+            if resultado is not None:
+                self._cache.armazenar(chave, resultado)
+                return resultado
+            return _FALHA_MODERACAO
+        
+        return list(await asyncio.gather(*(moderar(texto) for texto in textos)))
+    
+    def _moderar(self, texto: str) -> Optional[Tuple[bool, str, Optional[Dict]]]:
         try:
             if self.debug:
-                print(f"[DEBUG] Moderando: '{texto[:50]}...'")
+                log.debug("[DEBUG] Moderando: '%s...'", texto[:50])
 
             response = self.client.moderations.create(
                 model="omni-moderation-latest",
-                input=texto
+                input=self._entrada_api(texto)
             )
             
-            resultado = response.results[0]
-            
-            # Se foi flagged, bloquear
-            if resultado.flagged:
-                if self.debug:
-                    categorias_ativas = [k for k, v in resultado.categories.__dict__.items() if v]
-                    print(f"[MODERATION] Bloqueado - Categorias: {categorias_ativas}")
-                
-                return True, self._gerar_mensagem_bloqueio(resultado), response.model_dump()
+            return self._interpretar_resposta(response)
             
+        except Exception as e:
+            log.error("[ERRO] Erro na moderação: %s", e)
+            return None
+    
+    async def _moderar_async(self, texto: str) -> Optional[Tuple[bool, str, Optional[Dict]]]:
+        try:
             if self.debug:
-                print("[MODERATION] Aprovado")
+                log.debug("[DEBUG] Moderando: '%s...'", texto[:50])
             
-            return False, "", None
+            response = await self.async_client.moderations.create(
+                model="omni-moderation-latest",
+                input=self._entrada_api(texto)
+            )
+            
+            return self._interpretar_resposta(response)
             
         except Exception as e:
-            print(f"[ERRO] Erro na moderação: {e}")
-            return False, "", None 
+            log.error("[ERRO] Erro na moderação: %s", e)
+            return None
     
-    def _gerar_mensagem_bloqueio(self, resultado) -> str:
-        """Gera mensagem de bloqueio simples"""
+    @staticmethod
+    def _chave_cache(texto: str) -> bytes:
+        """Chave do cache: hash do texto inteiro (textos longos não ficam guardados como chave)"""
+        return hashlib.blake2b(texto.encode("utf-8"), digest_size=16).digest()
+    
+    def _entrada_api(self, texto: str):
+        """O texto, ou a lista das suas partes quando passa de MAX_CARACTERES_MODERACAO"""
+        tamanho = self.MAX_CARACTERES_MODERACAO
+        if len(texto) <= tamanho:
+            return texto
+        sobreposicao = self.SOBREPOSICAO_MODERACAO
+        return [texto[i:i + tamanho] for i in range(0, len(texto) - sobreposicao, tamanho - sobreposicao)]
+    
+    def _interpretar_resposta(self, response) -> Tuple[bool, str, Optional[Dict]]:
+        """Resultado (bloqueado, mensagem, detalhes) a partir da resposta da API de moderação"""
+        # Um resultado por parte do texto; basta uma parte marcada para bloquear
+        marcados = [resultado for resultado in response.results if resultado.flagged]
         
-        categorias_graves = ["violence", "harassment_threatening", "hate_threatening", "sexual_minors"]
-        categorias_ativas = [k for k, v in resultado.categories.__dict__.items() if v]
+        # Se foi flagged, bloquear
+        if marcados:
+            # Categorias ativas levantadas uma vez, para o log e para a mensagem
+            categorias_ativas = [
+                c for c in self._CATEGORIAS
+                if any(getattr(resultado.categories, c, False) for resultado in marcados)
+            ]
+            if self.debug:
+                log.debug("[MODERATION] Bloqueado - Categorias: %s", categorias_ativas)
+            
+            return True, self._gerar_mensagem_bloqueio(categorias_ativas), response.model_dump()
         
-        categoria_encontrada = None
-        for categoria in categorias_graves:
-            if categoria in categorias_ativas:
-                categoria_encontrada = categoria
-                break
+        if self.debug:
+            log.debug("[MODERATION] Aprovado")
         
-        mensagens = {
-            "violence": "conteúdo violento",
-            "harassment": "assédio ou intimidação", 
-            "harassment_threatening": "ameaças",
-            "hate": "discurso de ódio",
-            "sexual": "conteúdo sexual inapropriado",
-            "illicit": "atividades ilegais",
-            "illicit_violent": "atividades ilegais violentas", 
-            "self_harm": "conteúdo relacionado a autolesão"
-        }
+        return False, "", None
+    
+    def _gerar_mensagem_bloqueio(self, categorias_ativas: List[str]) -> str:
+        """Gera mensagem de bloqueio simples"""
         
-        # Encontrar descrição ou usar genérica
-        DESCRICAO_PADRAO = "conteúdo inapropriado"
-        descricao = DESCRICAO_PADRAO
-        if categoria_encontrada:
-            descricao = mensagens.get(categoria_encontrada, DESCRICAO_PADRAO)
-        elif categorias_ativas:
-            primeira_categoria = categorias_ativas[0]
-            descricao = mensagens.get(primeira_categoria, DESCRICAO_PADRAO)
+        # Primeira categoria grave ativa; senão a primeira ativa (uma única varredura de
+        # _PRIORIDADE); a descrição sai da tabela
+        ativas = frozenset(categorias_ativas)
+        categoria = next((c for c in self._PRIORIDADE if c in ativas), None)
+        descricao = self._DESCRICOES.get(categoria, self._DESCRICAO_PADRAO)
         
-        return f"""🚫 **Conteúdo Bloqueado**
-
-Sua mensagem foi bloqueada por conter {descricao}.
-
-Este é um sistema de atendimento bancário profissional. Por favor, mantenha suas perguntas relacionadas aos serviços da Caixa Econômica Federal.
-
-Como posso ajudá-lo com questões sobre empréstimos, FGTS ou outros serviços bancários?"""
+        return self._MSG_BLOQUEIO.format(descricao=descricao)
     
     def obter_detalhes_moderacao(self, response_dict: Dict) -> str:
         """Gera relatório simples para debug (opcional)"""
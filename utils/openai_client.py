@@ -0,0 +1,43 @@
+import asyncio
+import atexit
+import importlib.util
+import os
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+load_dotenv()
+
+# HTTP/2 multiplexa as requisições em uma única conexão TLS; só é ativado quando o
+# extra h2 está instalado (pip install "httpx[http2]"), senão fica no HTTP/1.1 com keep-alive
+HTTP2_DISPONIVEL = importlib.util.find_spec("h2") is not None
+
+# Clientes únicos do processo: agentes, guardrails, resumo e boas-vindas compartilham o
+# mesmo pool de conexões em vez de cada módulo abrir (e aquecer) o seu
+client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultHttpxClient(http2=HTTP2_DISPONIVEL)
+)
+async_client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(http2=HTTP2_DISPONIVEL)
+)
+
+# As conexões do async_client ficam presas ao loop de eventos em que foram abertas: um
+# asyncio.run por turno fecharia o loop e a chamada seguinte falharia com "Event loop is
+# closed". Todas as entradas síncronas usam este loop único, que vive o processo inteiro
+_loop = asyncio.new_event_loop()
+
+
+def executar_no_loop(corrotina):
+    """Roda a corrotina no loop compartilhado do processo (use no lugar de asyncio.run)
+
+    Não é reentrante nem seguro entre threads: deve ser chamada pela thread principal,
+    fora de um loop em execução (como o main.py faz).
+    """
+    return _loop.run_until_complete(corrotina)
+
+
+@atexit.register
+def _fechar_loop() -> None:
+    _loop.run_until_complete(_loop.shutdown_asyncgens())
+    _loop.close()
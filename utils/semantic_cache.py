@@ -0,0 +1,65 @@
+import threading
+import time
+from operator import mul
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+
+class CacheSemantico:
+    """
+    Cache de respostas por similaridade de embedding, separado por CPF
+
+    Perguntas com cosseno >= limiar em relação a uma pergunta recente do mesmo cliente
+    reaproveitam a resposta já gerada, sem passar pelos agentes. Os embeddings da OpenAI
+    já vêm normalizados, então o cosseno é o produto escalar.
+    
+    A assinatura (ex.: os números da pergunta) precisa ser idêntica para haver acerto:
+    "empréstimo de 1000 em 10 parcelas" e "...2000..." ficam acima do limiar de cosseno,
+    mas não podem compartilhar a resposta.
+    """
+
+    def __init__(self, limiar: float = 0.95, max_por_cpf: int = 64, ttl_segundos: float = 600.0):
+        self.limiar = limiar
+        self.max_por_cpf = max_por_cpf
+        self.ttl_segundos = ttl_segundos
+        self._entradas: Dict[str, List[Tuple[float, Tuple[float, ...], str, str, Hashable]]] = {}
+        self._lock = threading.Lock()
+
+    def buscar(self, cpf: str, embedding: Sequence[float], assinatura: Hashable = ()) -> Optional[Tuple[str, str]]:
+        """Retorna (resposta, agente) da pergunta mais parecida acima do limiar, ou None"""
+        agora = time.monotonic()
+        with self._lock:
+            entradas = self._entradas.get(cpf)
+            if not entradas:
+                return None
+
+            # Descarta expiradas (a lista está em ordem de inserção)
+            validas = [e for e in entradas if agora - e[0] < self.ttl_segundos]
+            if len(validas) != len(entradas):
+                self._entradas[cpf] = validas
+
+            melhor, melhor_similaridade = None, self.limiar
+            for entrada in validas:
+                if entrada[4] != assinatura:
+                    continue
+                similaridade = sum(map(mul, entrada[1], embedding))
+                if similaridade >= melhor_similaridade:
+                    melhor, melhor_similaridade = entrada, similaridade
+
+        if melhor is None:
+            return None
+        return melhor[2], melhor[3]
+
+    def armazenar(self, cpf: str, embedding: Sequence[float], resposta: str, agente: str,
+                  assinatura: Hashable = ()) -> None:
+        with self._lock:
+            entradas = self._entradas.setdefault(cpf, [])
+            entradas.append((time.monotonic(), tuple(embedding), resposta, agente, assinatura))
+            if len(entradas) > self.max_por_cpf:
+                del entradas[0]
+
+    def limpar(self, cpf: Optional[str] = None) -> None:
+        with self._lock:
+            if cpf is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(cpf, None)
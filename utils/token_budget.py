@@ -0,0 +1,55 @@
+from functools import lru_cache
+from typing import Dict, List
+
+try:
+    # Contagem exata com o tokenizer dos modelos gpt-4o (opcional)
+    import tiktoken
+    _codificador = tiktoken.get_encoding("o200k_base")
+
+    def _tokens(texto: str) -> int:
+        return len(_codificador.encode(texto, disallowed_special=()))
+except Exception:
+    # Sem o tiktoken, ou sem conseguir baixar o vocabulário (get_encoding busca o arquivo
+    # na rede na primeira vez): a importação do módulo nunca falha por isso
+    def _tokens(texto: str) -> int:
+        # Estimativa de ~4 caracteres por token, suficiente para impor um teto
+        return len(texto) // 4 + 1
+
+# Custo fixo aproximado de cada mensagem no formato de chat (role + delimitadores)
+TOKENS_POR_MENSAGEM = 4
+
+
+@lru_cache(maxsize=4096)
+def contar_tokens(texto: str) -> int:
+    """Tokens de um texto; o cache evita recontar o mesmo histórico a cada turno"""
+    return _tokens(texto) + TOKENS_POR_MENSAGEM
+
+
+def podar_por_tokens(mensagens: List[Dict], limite: int) -> List[Dict]:
+    """
+    Mantém as mensagens de sistema e as mensagens de conversa mais recentes que cabem em `limite` tokens
+
+    Complementa a janela por número de turnos: uma única mensagem muito longa não estoura
+    o contexto (nem a latência) da requisição. A conversa mantida sempre começa em uma
+    mensagem do usuário, para não deixar uma resposta sem a pergunta correspondente.
+    """
+    custos = [contar_tokens(msg.get("content") or "") for msg in mensagens]
+    if sum(custos) <= limite:
+        return mensagens
+
+    disponivel = limite - sum(c for msg, c in zip(mensagens, custos) if msg.get("role") == "system")
+    mantidas = set()
+    for i in range(len(mensagens) - 1, -1, -1):
+        if mensagens[i].get("role") == "system":
+            continue
+        if custos[i] > disponivel:
+            break
+        disponivel -= custos[i]
+        mantidas.add(i)
+
+    for i in sorted(mantidas):
+        if mensagens[i].get("role") != "assistant":
+            break
+        mantidas.discard(i)
+
+    return [msg for i, msg in enumerate(mensagens) if msg.get("role") == "system" or i in mantidas]